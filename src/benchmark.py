@@ -0,0 +1,324 @@
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+import torch
+import torch.nn as nn
+import yaml
+from sklearn.preprocessing import StandardScaler
+from torch.utils.data import Dataset, DataLoader
+
+from data_loader import load_data, data_filters
+from feature_store import open_feature_store
+from model import FinReportModel, SequenceModel, autocast, compile_model, COMPILE_MODES
+from preprocessing import FeatureSchema, select_features, normalize_features
+from windows import WindowDataset, WindowBatchLoader, StockChunkLoader, window_loader, slice_offsets, stock_segments
+
+
+def measure(fn, *args, **kwargs):
+    """
+    Run fn once, tracking wall time and the peak of Python-allocated memory
+    (numpy buffers are traced by tracemalloc).
+
+    Returns:
+        tuple: (result, seconds, peak_mb)
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak / 1024 ** 2
+
+
+def report(title, rows):
+    print(f"\n{title}")
+    print(f"{'path':<12}{'time (s)':>12}{'peak (MB)':>12}")
+    for name, elapsed, peak in rows:
+        print(f"{name:<12}{elapsed:>12.3f}{peak:>12.1f}")
+    (_, base_t, base_m), (_, new_t, new_m) = rows[0], rows[-1]
+    print(f"speedup x{base_t / max(new_t, 1e-9):.2f}, peak memory x{base_m / max(new_m, 1e-9):.2f} lower")
+
+
+def _windows(features, seq_len, to_tensor):
+    """Touch every sequence window the way FinDataset.__getitem__ does."""
+    total = 0
+    for idx in range(len(features) - seq_len):
+        total += to_tensor(features[idx:idx + seq_len]).shape[0]
+    return total
+
+
+def legacy_features(df, schema, seq_len):
+    """The previous path: float64 block copy, scaler copy, torch.tensor per window."""
+    features = df.iloc[:, schema.indexer(df)].to_numpy(dtype=np.float64)
+    features = StandardScaler().fit_transform(features)
+    _windows(features, seq_len, lambda x: torch.tensor(x, dtype=torch.float))
+    return features
+
+
+def current_features(df, schema, seq_len):
+    """select_features -> in-place normalization -> zero-copy windows."""
+    features, _ = select_features(df, schema)
+    features, _ = normalize_features(features)
+    _windows(features, seq_len, lambda x: torch.as_tensor(x, dtype=torch.float))
+    return features
+
+
+def bench_features(args, config):
+    df = load_data(args.data or config['data_path'], exclude=['announcement'])
+    schema = FeatureSchema.from_frame(df)
+    print(f"{len(df)} rows x {schema.input_size} features")
+    rows = []
+    for name, fn in [('legacy', legacy_features), ('current', current_features)]:
+        result, elapsed, peak = measure(fn, df, schema, args.seq_len)
+        rows.append((name, elapsed, peak))
+        print(f"{name}: {result.dtype}, C-contiguous={result.flags['C_CONTIGUOUS']}")
+    report("Feature matrix construction", rows)
+
+
+class LegacyFinDataset(Dataset):
+    """The per-item dataset train.py used before windows.WindowDataset."""
+    def __init__(self, features, labels, seq_len):
+        self.features = features
+        self.labels = labels
+        self.seq_len = seq_len
+
+    def __len__(self):
+        return max(0, len(self.features) - self.seq_len)
+
+    def __getitem__(self, idx):
+        x = self.features[idx:idx + self.seq_len]
+        y = self.labels[idx + self.seq_len - 1]
+        return torch.tensor(x, dtype=torch.float), torch.tensor(y, dtype=torch.float)
+
+
+def _epoch(loader):
+    """Iterate one epoch; returns (windows, seconds)."""
+    start = time.perf_counter()
+    windows = 0
+    for x_batch, _ in loader:
+        windows += x_batch.shape[0]
+    return windows, time.perf_counter() - start
+
+
+def bench_windows(args, config):
+    store = open_feature_store(args.data or config['data_path'], data_filters(config))
+    features, labels = store.features, store.labels
+    print(f"{len(features)} rows x {features.shape[1]} features, seq_len={args.seq_len}, batch_size={args.batch_size}")
+    dataset = WindowDataset(features, labels, args.seq_len)
+    loaders = [
+        ('legacy', DataLoader(LegacyFinDataset(features, labels, args.seq_len),
+                              batch_size=args.batch_size, shuffle=True)),
+        ('windows', window_loader(dataset, batch_size=args.batch_size, shuffle=True)),
+        ('batched', WindowBatchLoader(dataset, args.batch_size, shuffle=True)),
+        ('resident', WindowBatchLoader(dataset, args.batch_size, shuffle=True, resident_mb=float('inf'))),
+    ]
+    print(f"\nOne shuffled epoch, best of {args.repeat}")
+    print(f"{'path':<12}{'time (s)':>12}{'windows/s':>14}")
+    rates = []
+    for name, loader in loaders:
+        windows, elapsed = min((_epoch(loader) for _ in range(args.repeat)), key=lambda r: r[1])
+        rates.append(windows / elapsed)
+        print(f"{name:<12}{elapsed:>12.3f}{rates[-1]:>14,.0f}  x{rates[-1] / rates[0]:.2f}")
+
+
+def _training_loaders(args, config):
+    """Train/validation window loaders over the training split of the feature store, as in train.py."""
+    store = open_feature_store(args.data or config['data_path'], data_filters(config))
+    split = store.train_rows()
+    dataset = WindowDataset(store.features[:split], store.labels[:split], config['seq_len'],
+                            offsets=slice_offsets(store.offsets, 0, split))
+    val_size = int(0.2 * len(dataset))
+    train_set, val_set = torch.utils.data.random_split(
+        dataset, [len(dataset) - val_size, val_size], generator=torch.Generator().manual_seed(0))
+    return (WindowBatchLoader(train_set, config['batch_size'], shuffle=True),
+            WindowBatchLoader(val_set, config['batch_size']))
+
+
+def _new_model(config):
+    model_config = config['model']
+    return FinReportModel(input_size=model_config['input_size'], hidden_size=model_config['hidden_size'],
+                          num_layers=model_config.get('num_layers', 1), dropout=model_config.get('dropout', 0.0))
+
+
+def _train_epochs(model, train_loader, val_loader, epochs, lr, mixed_precision=False):
+    """Train like train.py; returns per-epoch (seconds, validation loss)."""
+    device = torch.device('cpu')
+    optimizer = torch.optim.Adam(model.parameters(), lr=lr)
+    criterion = nn.MSELoss()
+    history = []
+    for _ in range(epochs):
+        start = time.perf_counter()
+        model.train()
+        for x_batch, y_batch in train_loader:
+            optimizer.zero_grad()
+            with autocast(device, mixed_precision):
+                outputs = model(x_batch)
+            loss = criterion(outputs, y_batch)
+            loss.backward()
+            torch.nn.utils.clip_grad_norm_(model.parameters(), max_norm=1.0)
+            optimizer.step()
+        elapsed = time.perf_counter() - start
+        model.eval()
+        val_loss = 0.0
+        with torch.no_grad():
+            for x_val, y_val in val_loader:
+                with autocast(device, mixed_precision):
+                    outputs = model(x_val)
+                val_loss += criterion(outputs, y_val).item() * x_val.size(0)
+        history.append((elapsed, val_loss / len(val_loader.dataset)))
+    return history
+
+
+def bench_precision(args, config):
+    train_loader, val_loader = _training_loaders(args, config)
+    print(f"{len(train_loader.dataset)} training windows, {args.epochs} epochs per mode")
+    print(f"\n{'mode':<12}{'epoch (s)':>12}{'val loss':>12}")
+    results = []
+    for name, mixed_precision in [('float32', False), ('bfloat16', True)]:
+        torch.manual_seed(0)
+        history = _train_epochs(_new_model(config), train_loader, val_loader, args.epochs,
+                                config['learning_rate'], mixed_precision)
+        # The first epoch includes one-off warm-up costs
+        epoch_time = np.median([elapsed for elapsed, _ in history[1:] or history])
+        results.append(epoch_time)
+        print(f"{name:<12}{epoch_time:>12.3f}{history[-1][1]:>12.6f}")
+    print(f"bfloat16 epoch time x{results[0] / results[1]:.2f}")
+
+
+def _per_call_ms(fn, repeat):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def bench_compile(args, config):
+    model_config = config['model']
+    x = torch.randn(config['batch_size'], config['seq_len'], model_config['input_size'])
+    y = torch.randn(config['batch_size'])
+    criterion = nn.MSELoss()
+    print(f"batch {tuple(x.shape)}, {args.repeat} calls per measurement")
+    print(f"\n{'mode':<10}{'startup (s)':>13}{'infer (ms)':>12}{'train (ms)':>12}")
+    for mode in COMPILE_MODES:
+        torch.manual_seed(0)
+        model = _new_model(config)
+        optimizer = torch.optim.Adam(model.parameters(), lr=config['learning_rate'])
+        start = time.perf_counter()
+        module = compile_model(model, mode, example_input=x, trace_func=lambda msg: None)
+        startup = time.perf_counter() - start
+
+        model.eval()
+        with torch.no_grad():
+            infer_ms = _per_call_ms(lambda: module(x), args.repeat)
+
+        def train_step(forward):
+            optimizer.zero_grad()
+            criterion(forward(x), y).backward()
+            optimizer.step()
+        train_module = compile_model(model, mode, example_input=x, training=True, trace_func=lambda msg: None)
+        model.train()
+        train_ms = _per_call_ms(lambda: train_step(train_module), args.repeat)
+        print(f"{mode:<10}{startup:>13.2f}{infer_ms:>12.2f}{train_ms:>12.2f}")
+    print("(script trains eagerly; startup includes the first, compiling call)")
+
+
+def _windowed_epoch(model, optimizer, criterion, loader):
+    model.train()
+    for x_batch, y_batch in loader:
+        optimizer.zero_grad()
+        criterion(model(x_batch), y_batch).backward()
+        optimizer.step()
+
+
+def _stateful_epoch(model, optimizer, criterion, loader):
+    """Truncated BPTT as train.stateful_pass, without its bookkeeping."""
+    module = SequenceModel(model).train()
+    state = None
+    for x, y, mask, reset in loader:
+        state = None if reset else tuple(s.detach() for s in state)
+        preds, state = module(x, state, mask)
+        if mask.sum() > 1:
+            optimizer.zero_grad()
+            criterion(preds, y[mask]).backward()
+            optimizer.step()
+
+
+def bench_stateful(args, config):
+    store = open_feature_store(args.data or config['data_path'], data_filters(config))
+    split = store.train_rows()
+    features, labels = store.features[:split], store.labels[:split]
+    offsets = slice_offsets(store.offsets, 0, split)
+    seq_len, batch_size = config['seq_len'], config['batch_size']
+    windows = WindowDataset(features, labels, seq_len, offsets=offsets)
+    loaders = [
+        ('windowed', WindowBatchLoader(windows, batch_size, shuffle=True), _windowed_epoch,
+         len(windows), len(windows) * seq_len),
+        ('stateful', StockChunkLoader(features, labels, stock_segments(offsets), args.bptt_len, batch_size,
+                                      shuffle=True, warmup=seq_len - 1), _stateful_epoch, None, split),
+    ]
+    print(f"{split} training rows, seq_len={seq_len}, bptt_len={args.bptt_len}, best of {args.repeat} epochs")
+    print(f"\n{'mode':<10}{'scored':>10}{'LSTM steps':>12}{'epoch (s)':>11}{'scored/s':>12}")
+    rates = []
+    for name, loader, run_epoch, scored, steps in loaders:
+        scored = scored if scored is not None else loader.num_samples()
+        torch.manual_seed(0)
+        model = _new_model(config)
+        optimizer = torch.optim.Adam(model.parameters(), lr=config['learning_rate'])
+        criterion = nn.MSELoss()
+        times = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            run_epoch(model, optimizer, criterion, loader)
+            times.append(time.perf_counter() - start)
+        rates.append(scored / min(times))
+        print(f"{name:<10}{scored:>10,}{steps:>12,}{min(times):>11.3f}{rates[-1]:>12,.0f}")
+    print(f"stateful scored steps/s x{rates[1] / rates[0]:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the FinReport data path.")
+    parser.add_argument('--config', default='src/config.yaml')
+    parser.add_argument('--data', default=None, help="CSV path (defaults to config data_path)")
+    sub = parser.add_subparsers(dest='bench', required=True)
+
+    features = sub.add_parser('features', help="feature matrix build, normalization and window tensors")
+    features.add_argument('--seq-len', type=int, default=None)
+    features.set_defaults(func=bench_features)
+
+    windows = sub.add_parser('windows', help="per-item FinDataset vs batched WindowDataset loaders")
+    windows.add_argument('--seq-len', type=int, default=None)
+    windows.add_argument('--batch-size', type=int, default=None)
+    windows.add_argument('--repeat', type=int, default=3)
+    windows.set_defaults(func=bench_windows)
+
+    precision = sub.add_parser('precision', help="float32 vs bfloat16 autocast training: epoch time and validation loss")
+    precision.add_argument('--epochs', type=int, default=3)
+    precision.set_defaults(func=bench_precision)
+
+    compiled = sub.add_parser('compile', help="eager vs torch.compile vs TorchScript: startup and per-batch times")
+    compiled.add_argument('--repeat', type=int, default=50)
+    compiled.set_defaults(func=bench_compile)
+
+    stateful = sub.add_parser('stateful', help="windowed vs truncated-BPTT stateful training epochs")
+    stateful.add_argument('--bptt-len', type=int, default=None)
+    stateful.add_argument('--repeat', type=int, default=3)
+    stateful.set_defaults(func=bench_stateful)
+
+    args = parser.parse_args()
+    with open(args.config, 'r') as f:
+        config = yaml.safe_load(f)
+    if getattr(args, 'seq_len', 0) is None:
+        args.seq_len = config['seq_len']
+    if getattr(args, 'batch_size', 0) is None:
+        args.batch_size = config['batch_size']
+    if getattr(args, 'bptt_len', 0) is None:
+        args.bptt_len = config.get('bptt_len', 50)
+    args.func(args, config)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+# src/checkpoint.py
+import os
+import copy
+import queue
+import random
+import threading
+import numpy as np
+import torch
+
+# Full training state, written every epoch so a run can be resumed
+CHECKPOINT_PATH = 'models/checkpoint.pt'
+
+
+def snapshot(obj):
+    """
+    In-memory copy of a (nested) checkpoint payload: tensors are cloned to
+    CPU, so training can keep updating the originals while the copy is
+    being written.
+    """
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return {key: snapshot(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot(value) for value in obj)
+    return copy.deepcopy(obj)
+
+
+def rng_state():
+    """RNG states of Python, NumPy and torch (shuffling and dropout draw from these)."""
+    state = {
+        'python': random.getstate(),
+        'numpy': np.random.get_state(),
+        'torch': torch.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+def _write(payload, path):
+    # Write next to the target and rename, so a crash never leaves a torn file
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    torch.save(payload, tmp_path)
+    os.replace(tmp_path, path)
+
+
+class AsyncCheckpointer:
+    """
+    Writes checkpoints on a background thread.
+
+    save() snapshots the payload in memory (a copy of the tensors, no disk
+    I/O) and queues it; the writer thread serializes it with torch.save.
+    If several saves for the same path are queued, only the newest is
+    written. Call wait() before reading a checkpoint back and close() at
+    the end of the run; a failed write is re-raised from the next call.
+
+    Args:
+        enabled (bool): False writes synchronously on the calling thread.
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._error = None
+        self._thread = None
+        if enabled:
+            self._thread = threading.Thread(target=self._run, name='checkpoint-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            path = self._queue.get()
+            try:
+                if path is None:
+                    return
+                with self._lock:
+                    payload = self._pending.pop(path, None)
+                if payload is not None:
+                    _write(payload, path)
+            except Exception as e:  # surfaced to the training loop by _check
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _check(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError(f"Checkpoint write failed: {error}") from error
+
+    def save(self, payload, path):
+        self._check()
+        payload = snapshot(payload)
+        if not self.enabled:
+            _write(payload, path)
+            return
+        with self._lock:
+            queued = path in self._pending
+            self._pending[path] = payload
+        if not queued:
+            self._queue.put(path)
+
+    def wait(self):
+        """Block until every queued checkpoint is on disk."""
+        if self.enabled:
+            self._queue.join()
+        self._check()
+
+    def close(self):
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._check()
+
+
+def load_checkpoint(path=CHECKPOINT_PATH):
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No checkpoint to resume from at {path}")
+    # The payload holds optimizer/scheduler state and RNG states, not just tensors
+    return torch.load(path, map_location='cpu', weights_only=False)
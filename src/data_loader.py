@@ -1,5 +1,11 @@
-import pandas as pd
+import os
 import ast
+import pickle
+import tempfile
+import numpy as np
+import pandas as pd
+from data_store import (DatasetStore, NewsTable, StockPartitions, StoredNews, apply_dtype_plan, default_cache_dir,
+                        filter_rows, merge_rows)
 
 def try_literal_eval(val):
     if isinstance(val, str) and (val.startswith('[') or val.startswith('{')):
@@ -9,14 +15,427 @@ def try_literal_eval(val):
             pass
     return val
 
-def load_data(csv_path):
-    df = pd.read_csv(csv_path)
-    # Apply conditional parsing to the 'announcement' column:
-    df['announcement'] = df['announcement'].apply(try_literal_eval)
+class AnnouncementParser:
+    """
+    Memoized try_literal_eval for raw announcement strings.
+
+    Announcements are kept as the raw strings from the CSV and only parsed
+    when a row is actually used. Results are memoized by the raw string and,
+    when a path is given, pickled so later runs can skip ast.literal_eval
+    entirely. Parsed objects are shared between calls; treat them as read-only.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self._memo = None
+        self._unsaved = 0
+
+    def _load(self):
+        self._memo = {}
+        if self.path and os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                self._memo = pickle.load(f)
+
+    def __call__(self, val):
+        if not isinstance(val, str):
+            return val
+        if self._memo is None:
+            self._load()
+        try:
+            return self._memo[val]
+        except KeyError:
+            parsed = try_literal_eval(val)
+            self._memo[val] = parsed
+            self._unsaved += 1
+            return parsed
+
+    def __len__(self):
+        if self._memo is None:
+            self._load()
+        return len(self._memo)
+
+    def save(self):
+        """Persist newly parsed announcements (no-op without a path or new entries)."""
+        if not self.path or not self._unsaved:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(self._memo, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+        self._unsaved = 0
+
+_parsers = {}
+
+def announcement_parser(csv_path):
+    """Shared AnnouncementParser for a dataset, persisted in its cache directory."""
+    key = os.path.abspath(csv_path)
+    if key not in _parsers:
+        _parsers[key] = AnnouncementParser(os.path.join(default_cache_dir(csv_path), 'announcements.pkl'))
+    return _parsers[key]
+
+def _resolve_columns(all_columns, columns=None, exclude=None):
+    """Apply a column projection (keep `columns`, then drop `exclude`) in file order."""
+    if columns is None and not exclude:
+        return None
+    keep = set(all_columns if columns is None else columns)
+    missing = keep.difference(all_columns)
+    if missing:
+        raise KeyError(f"Columns not found in dataset: {sorted(missing)}")
+    drop = set(exclude or [])
+    return [col for col in all_columns if col in keep and col not in drop]
+
+def load_data(csv_path, columns=None, exclude=None, ts_codes=None, start_date=None, end_date=None,
+              use_cache=True, parse_announcements=False):
+    """
+    Load the stock dataset.
+
+    On first use the CSV is converted to a Parquet cache next to it (see
+    data_store.DatasetStore) and later loads read the cache instead of
+    re-parsing the CSV. Pass `columns` and/or `exclude` to read only the
+    columns a caller needs, e.g. exclude=['announcement'] for training.
+
+    `ts_codes` and `start_date`/`end_date` restrict the rows to a stock
+    universe and an inclusive date range. With the cache these are pushed
+    down to the store, which only reads the row groups that can match.
+
+    The frame comes back with compact dtypes (see data_store.dtype_plan):
+    float32 technical/factor columns (other numeric columns float64),
+    categorical 'ts_code' and datetime64 'date'.
+
+    The 'announcement' column is returned as raw strings; parse rows on
+    access with announcement_parser(csv_path), or pass
+    parse_announcements=True to parse the whole column up front.
+
+    Args:
+        csv_path (str): Path to the source CSV.
+        columns (list): Columns to load (default: all).
+        exclude (list): Columns to leave out.
+        ts_codes (list): Stocks to load (default: all).
+        start_date, end_date (str or Timestamp): Inclusive date range (default: all dates).
+        use_cache (bool): Read through the Parquet cache when pyarrow is available.
+        parse_announcements (bool): Eagerly parse the 'announcement' column.
+    """
+    store = DatasetStore(csv_path)
+    if use_cache and store.available():
+        store.ensure()
+        df = store.read(columns=_resolve_columns(store.columns(), columns, exclude),
+                        ts_codes=ts_codes, start_date=start_date, end_date=end_date)
+    else:
+        header = pd.read_csv(csv_path, nrows=0).columns.tolist()
+        projected = usecols = _resolve_columns(header, columns, exclude)
+        filtered = ts_codes is not None or start_date is not None or end_date is not None
+        if filtered and projected is not None:
+            usecols = [col for col in ('ts_code', 'date') if col not in projected] + projected
+        df = apply_dtype_plan(pd.read_csv(csv_path, usecols=usecols), report=True)
+        df = filter_rows(df, ts_codes, start_date, end_date).reset_index(drop=True)
+        if usecols is not projected:
+            df = df[projected]
+
+    if parse_announcements and 'announcement' in df.columns:
+        parser = announcement_parser(csv_path)
+        df['announcement'] = df['announcement'].map(parser)
+        parser.save()
     return df
 
+def _news_item_text(item):
+    """Flatten one parsed news item to text (dict items join their values)."""
+    if isinstance(item, dict):
+        return " ".join(str(v) for v in item.values() if v is not None and str(v) != "")
+    return str(item)
+
+def _news_items(parsed):
+    """Split a parsed announcement cell into its news item texts."""
+    if parsed is None or (isinstance(parsed, float) and pd.isna(parsed)):
+        return []
+    if isinstance(parsed, (list, tuple)):
+        items = [_news_item_text(item) for item in parsed]
+    else:
+        items = [_news_item_text(parsed)]
+    return [item for item in items if item.strip()]
+
+def build_news_frame(df, parser=try_literal_eval, key='ts_code'):
+    """
+    Explode the 'announcement' column of a price frame into a long-format
+    news frame (stock_id, date, item, text), sorted by stock and date.
+
+    Returns:
+        tuple: (news DataFrame, list of ts_codes indexed by stock_id)
+    """
+    stock_ids, stocks = pd.factorize(df[key])
+    news = pd.DataFrame({
+        'stock_id': stock_ids.astype('int32'),
+        'date': df['date'].to_numpy(),
+        'text': df['announcement'].map(parser).map(_news_items).to_numpy(),
+    })
+    news = news.explode('text', ignore_index=False).dropna(subset=['text'])
+    news['item'] = news.groupby(level=0).cumcount().astype('int16')
+    news = news.sort_values(['stock_id', 'date', 'item'], kind='stable').reset_index(drop=True)
+    news['text'] = news['text'].astype(pd.StringDtype('pyarrow'))
+    return news[['stock_id', 'date', 'item', 'text']], list(stocks)
+
+def _iter_stock_news(csv_path, parser, stocks):
+    """
+    News frames of a few stocks at a time, streamed with iter_data; stock
+    ids are numbered in stream order, and each ts_code is appended to `stocks`.
+    """
+    stock_frames = iter_data(csv_path, by='stock', columns=['ts_code', 'date', 'announcement'])
+    for batch_stocks, frame in group_stock_frames(stock_frames):
+        news, _ = build_news_frame(frame, parser)
+        news['stock_id'] += np.int32(len(stocks))
+        stocks.extend(str(stock) for stock in batch_stocks)
+        yield news
+
+def load_news(csv_path, use_cache=True, lazy=False):
+    """
+    Load the news table split out of the 'announcement' column.
+
+    With the Parquet cache the table is built once per source file, a few
+    stocks at a time (parsing each announcement through the persisted
+    AnnouncementParser memo), and stored as news.parquet; later loads read
+    it directly.
+
+    Args:
+        lazy (bool): Return a StoredNews that reads one stock's news at a
+            time from news.parquet instead of loading the whole table
+            (needs the cache).
+
+    Returns:
+        NewsTable
+    """
+    store = DatasetStore(csv_path)
+    if use_cache and store.available():
+        store.ensure()
+        if not store.news_is_fresh():
+            parser = announcement_parser(csv_path)
+            try:
+                stocks = []
+                store.write_news(_iter_stock_news(csv_path, parser, stocks), stocks)
+            except ValueError:
+                # Some stock's rows are not contiguous: build the table in memory
+                news, stocks = build_news_frame(store.read(columns=['ts_code', 'date', 'announcement']), parser)
+                store.write_news(news, stocks)
+            parser.save()
+        if lazy:
+            return StoredNews(store)
+        return NewsTable(*store.read_news())
+
+    df = apply_dtype_plan(pd.read_csv(csv_path, usecols=['ts_code', 'date', 'announcement']))
+    return NewsTable(*build_news_frame(df, announcement_parser(csv_path)))
+
+def _iter_stock_frames(batches, key='ts_code'):
+    """
+    Regroup a stream of row batches into one frame per stock. Rows must be
+    grouped by stock (as in stock_data.csv); the last stock of a batch is
+    carried over since it may continue in the next one.
+    """
+    carry = None
+    seen = set()
+    for batch in batches:
+        if carry is not None:
+            batch = pd.concat([carry, batch], ignore_index=True)
+        if len(batch) == 0:
+            continue
+        codes = batch[key].to_numpy()
+        tail_start = len(codes) - 1
+        while tail_start > 0 and codes[tail_start - 1] == codes[-1]:
+            tail_start -= 1
+        carry = batch.iloc[tail_start:]
+        for stock, frame in StockPartitions.from_frame(batch.iloc[:tail_start], key=key):
+            if stock in seen:
+                raise ValueError(f"Rows of {stock} are not contiguous; stream with by='date' instead")
+            seen.add(stock)
+            yield stock, frame
+    if carry is not None and len(carry):
+        stock = carry[key].iloc[0]
+        if stock in seen:
+            raise ValueError(f"Rows of {stock} are not contiguous; stream with by='date' instead")
+        yield stock, carry.reset_index(drop=True)
+
+def group_stock_frames(stock_frames, batch_rows=65536):
+    """
+    Concatenate consecutive (ts_code, frame) pairs, as from
+    iter_data(by='stock'), into (ts_codes, frame) batches of about
+    batch_rows rows, for work that is cheaper on fewer, larger frames.
+    A stock is never split across batches.
+    """
+    stocks, frames, rows = [], [], 0
+    for stock, frame in stock_frames:
+        stocks.append(stock)
+        frames.append(frame)
+        rows += len(frame)
+        if rows >= batch_rows:
+            yield stocks, pd.concat(frames, ignore_index=True)
+            stocks, frames, rows = [], [], 0
+    if frames:
+        yield stocks, pd.concat(frames, ignore_index=True)
+
+def iter_data(csv_path, by='stock', columns=None, exclude=None, ts_codes=None, start_date=None,
+              end_date=None, dates_per_chunk=250, batch_rows=65536, use_cache=True):
+    """
+    Stream the dataset in chunks instead of materializing it in one frame.
+
+    Args:
+        csv_path (str): Path to the source CSV.
+        by (str): 'stock' yields (ts_code, frame) for each stock in file order;
+            'date' yields ((first_date, last_date), frame) for consecutive
+            windows of `dates_per_chunk` trading days across all stocks.
+        columns, exclude: Column projection, as in load_data.
+        ts_codes, start_date, end_date: Row filters, as in load_data.
+        dates_per_chunk (int): Trading days per chunk when by='date'.
+        batch_rows (int): Rows read from disk at a time.
+
+    Peak memory is bounded by the largest stock (plus one read batch) or
+    by one date window, rather than by the whole file. Without the cache,
+    by='date' spills the windows to a temporary directory in one pass over
+    the CSV.
+    """
+    if by not in ('stock', 'date'):
+        raise ValueError(f"by must be 'stock' or 'date', got {by!r}")
+
+    store = DatasetStore(csv_path)
+    cached = use_cache and store.available()
+    if cached:
+        store.ensure()
+        all_columns = store.columns()
+    else:
+        all_columns = pd.read_csv(csv_path, nrows=0).columns.tolist()
+    usecols = _resolve_columns(all_columns, columns, exclude)
+    has_deltas = cached and bool(store.deltas())
+    filtered = ts_codes is not None or start_date is not None or end_date is not None
+    # The grouping key (and the row key, to merge deltas or filter rows) has
+    # to be read even if the caller did not ask for it.
+    if has_deltas or filtered:
+        keys = ['ts_code', 'date']
+    else:
+        keys = ['ts_code' if by == 'stock' else 'date']
+    extra = [] if usecols is None else [col for col in keys if col not in usecols]
+    read_cols = usecols if not extra else extra + usecols
+
+    def project(frame):
+        return frame.drop(columns=extra) if extra else frame
+
+    if by == 'stock':
+        if cached:
+            row_groups = store.select_row_groups(ts_codes, start_date, end_date) if filtered else None
+            batches = store.iter_batches(columns=read_cols, batch_rows=batch_rows, row_groups=row_groups)
+        else:
+            batches = pd.read_csv(csv_path, usecols=read_cols, chunksize=batch_rows)
+        if filtered:
+            batches = (filter_rows(apply_dtype_plan(batch), ts_codes, start_date, end_date) for batch in batches)
+        # Deltas are small (a few days); group them once and merge per stock.
+        delta_frames = {}
+        if has_deltas:
+            delta = store.read_deltas(columns=read_cols)
+            delta_frames = dict(StockPartitions.from_frame(filter_rows(delta, ts_codes, start_date, end_date)))
+        for stock, frame in _iter_stock_frames(batches):
+            frame = merge_rows(apply_dtype_plan(frame), delta_frames.pop(stock, None))
+            yield stock, project(frame)
+        # Stocks that only appear in ingested deltas
+        for stock, frame in delta_frames.items():
+            yield stock, project(frame.reset_index(drop=True))
+        return
+
+    if cached:
+        dates = store.read(columns=['date'], ts_codes=ts_codes, start_date=start_date, end_date=end_date)['date']
+    else:
+        dates = pd.concat(
+            filter_rows(apply_dtype_plan(batch), ts_codes, start_date, end_date)['date'].drop_duplicates()
+            for batch in pd.read_csv(csv_path, usecols=['ts_code', 'date'], chunksize=batch_rows)
+        )
+    dates = np.sort(dates.unique())
+    windows = [(dates[start], dates[min(start + dates_per_chunk, len(dates)) - 1])
+               for start in range(0, len(dates), dates_per_chunk)]
+    if cached:
+        for lo, hi in windows:
+            frame = store.read(columns=read_cols, ts_codes=ts_codes, start_date=lo, end_date=hi)
+            yield (lo, hi), project(apply_dtype_plan(frame.reset_index(drop=True)))
+        return
+
+    # Without the store the CSV is read once: each batch's rows are spilled
+    # to their date window's files, and every window is read back in turn.
+    lows = np.array([lo for lo, _ in windows])
+    with tempfile.TemporaryDirectory(prefix='iter_data-') as spill_dir:
+        parts = [[] for _ in windows]
+        for batch in pd.read_csv(csv_path, usecols=read_cols, chunksize=batch_rows):
+            batch = filter_rows(apply_dtype_plan(batch), ts_codes, start_date, end_date)
+            window_of_row = np.searchsorted(lows, batch['date'].to_numpy(), side='right') - 1
+            for window, part in batch.groupby(window_of_row, sort=False):
+                path = os.path.join(spill_dir, f"{window:06d}-{len(parts[window]):06d}.pkl")
+                part.to_pickle(path)
+                parts[window].append(path)
+        for (lo, hi), paths in zip(windows, parts):
+            frame = pd.concat([pd.read_pickle(path) for path in paths], ignore_index=True)
+            for path in paths:
+                os.remove(path)
+            yield (lo, hi), project(apply_dtype_plan(frame))
+
+def data_filters(config):
+    """
+    Row filters from config.yaml for load_data/iter_data: `universe` (a list
+    of ts_codes or a file with one per line) and `start_date`/`end_date`.
+    """
+    universe = config.get('universe')
+    if isinstance(universe, str):
+        with open(universe, 'r', encoding='utf-8') as f:
+            universe = [line.strip() for line in f if line.strip()]
+    return {
+        'ts_codes': universe,
+        'start_date': config.get('start_date'),
+        'end_date': config.get('end_date'),
+    }
+
+def _require_store(csv_path):
+    store = DatasetStore(csv_path)
+    if not store.available():
+        raise RuntimeError("Incremental ingest needs the Parquet store; install pyarrow")
+    return store.ensure()
+
+def ingest_delta(csv_path, delta):
+    """
+    Append a day's delta to the cached dataset without re-reading history.
+
+    Args:
+        csv_path (str): Path to the source CSV the store was built from.
+        delta (str or pd.DataFrame): Delta rows, or a path to a CSV/Parquet
+            file of them, with the same columns as the dataset.
+
+    Returns:
+        int: The new watermark. Pass it to load_changes later to get only
+        what was ingested after this point.
+    """
+    if isinstance(delta, str):
+        delta = pd.read_parquet(delta) if delta.endswith('.parquet') else pd.read_csv(delta)
+    store = _require_store(csv_path)
+    watermark = store.ingest(delta)
+    print(f"Ingested {store.deltas()[-1]['rows']} rows into {store.cache_dir} (watermark {watermark})")
+    return watermark
+
+def load_changes(csv_path, since=0, columns=None, exclude=None):
+    """
+    Rows ingested after watermark `since`, deduplicated on (ts_code, date).
+
+    Returns:
+        tuple: (DataFrame of changed rows, or None if nothing changed; current watermark)
+    """
+    store = _require_store(csv_path)
+    usecols = _resolve_columns(store.columns(), columns, exclude)
+    return store.read_deltas(since=since, columns=usecols), store.watermark()
+
 def split_data(df, train_ratio=0.6):
     train_size = int(len(df) * train_ratio)
     train_df = df.iloc[:train_size]
     test_df = df.iloc[train_size:]
     return train_df, test_df
+
+if __name__ == "__main__":
+    import argparse
+    import yaml
+
+    parser = argparse.ArgumentParser(description="Append a day's delta file to the cached dataset.")
+    parser.add_argument('delta', help="CSV or Parquet file with the new rows")
+    parser.add_argument('--config', default='src/config.yaml', help="Config with the dataset's data_path")
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as f:
+        config = yaml.safe_load(f)
+    ingest_delta(config['data_path'], args.delta)
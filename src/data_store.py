@@ -0,0 +1,672 @@
+# src/data_store.py
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional; data_loader falls back to read_csv
+    pa = None
+    ds = None
+    pq = None
+
+CACHE_VERSION = 4
+CACHE_DIRNAME = '.cache'
+MANIFEST_NAME = 'manifest.json'
+PRICES_NAME = 'prices.parquet'
+NEWS_NAME = 'news.parquet'
+DELTA_DIRNAME = 'deltas'
+ROW_KEY = ['ts_code', 'date']
+ROW_GROUP_SIZE = 65536
+
+
+# Dtype plan applied at load time. FinDataset feeds the model float32 anyway,
+# so the technical/factor feature columns are stored as float32. Other
+# numeric columns (label, close, vol, market_value, ...) keep float64:
+# market values around 1e11-1e12 need more than float32's ~7 digits.
+CATEGORICAL_COLUMNS = ['ts_code']
+DATE_COLUMNS = ['date']
+TEXT_COLUMNS = ['announcement']
+FEATURE_DTYPE = 'float32'
+NUMERIC_DTYPE = 'float64'
+# Technical indicator and factor groups, e.g. ('value_factor', 'F0') in the
+# CSV header, or value_factor_F0 after preprocessing.rename_technical_columns
+FEATURE_GROUP_PREFIXES = ('technical_indicators',)
+FEATURE_GROUP_SUFFIX = '_factor'
+
+
+def is_feature_column(col):
+    """Whether a raw or renamed column belongs to a technical/factor feature group."""
+    if not isinstance(col, str):
+        return False
+    if col.startswith('(') and col.endswith(')'):
+        group = col.strip('()').split(',')[0].strip(" '\"")
+        return group.startswith(FEATURE_GROUP_PREFIXES) or group.endswith(FEATURE_GROUP_SUFFIX)
+    return col.startswith(FEATURE_GROUP_PREFIXES) or (FEATURE_GROUP_SUFFIX + '_') in col
+
+
+def _parse_dates(series):
+    """Parse a date column once; integer dates are read as YYYYMMDD."""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    if pd.api.types.is_integer_dtype(series):
+        return pd.to_datetime(series.astype(str), format='%Y%m%d')
+    return pd.to_datetime(series)
+
+
+def dtype_plan(df):
+    """Target dtype for each column of a raw frame (columns already compact are skipped)."""
+    plan = {}
+    for col, dtype in df.dtypes.items():
+        if col in TEXT_COLUMNS:
+            continue
+        if col in CATEGORICAL_COLUMNS:
+            if not isinstance(dtype, pd.CategoricalDtype):
+                plan[col] = 'category'
+        elif col in DATE_COLUMNS:
+            if not pd.api.types.is_datetime64_any_dtype(dtype):
+                plan[col] = 'datetime64'
+        elif pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype):
+            target = FEATURE_DTYPE if is_feature_column(col) else NUMERIC_DTYPE
+            if dtype != target:
+                plan[col] = target
+    return plan
+
+
+def apply_dtype_plan(df, report=False):
+    """
+    Convert a frame to the compact dtypes of dtype_plan: float32
+    technical/factor columns (other numeric columns as float64),
+    categorical ts_code and datetime64 dates.
+
+    Args:
+        df (pd.DataFrame): Frame to convert.
+        report (bool): Print the memory footprint before and after.
+    """
+    plan = dtype_plan(df)
+    if not plan:
+        return df
+    before = df.memory_usage(deep=True).sum() if report else 0
+    converted = {}
+    for col, dtype in plan.items():
+        if dtype == 'datetime64':
+            converted[col] = _parse_dates(df[col])
+        else:
+            converted[col] = df[col].astype(dtype)
+    df = df.assign(**converted)
+    if report:
+        after = df.memory_usage(deep=True).sum()
+        print(f"Compact dtypes: {before / 1e6:.1f} MB -> {after / 1e6:.1f} MB "
+              f"({1 - after / max(before, 1):.0%} saved)")
+    return df
+
+
+def merge_rows(base, delta):
+    """
+    Union of base rows and newer delta rows. The later row wins for a
+    duplicated (ts_code, date), and the result is ordered by stock (first
+    appearance) and then by date, so every stock stays contiguous.
+    """
+    if delta is None or len(delta) == 0:
+        return base
+    merged = pd.concat([base, delta], ignore_index=True)
+    merged = merged.drop_duplicates(subset=ROW_KEY, keep='last')
+    stock_ids, _ = pd.factorize(merged['ts_code'])
+    order = np.lexsort((merged['date'].to_numpy(), stock_ids))
+    return apply_dtype_plan(merged.iloc[order].reset_index(drop=True))
+
+
+def row_predicate(ts_codes=None, start_date=None, end_date=None):
+    """
+    Arrow filter expression for a stock universe and an inclusive date range
+    (None when nothing is filtered).
+    """
+    predicate = None
+    if ts_codes is not None:
+        predicate = ds.field('ts_code').isin([str(code) for code in ts_codes])
+    if start_date is not None:
+        clause = ds.field('date') >= pd.Timestamp(start_date)
+        predicate = clause if predicate is None else predicate & clause
+    if end_date is not None:
+        clause = ds.field('date') <= pd.Timestamp(end_date)
+        predicate = clause if predicate is None else predicate & clause
+    return predicate
+
+
+def filter_rows(df, ts_codes=None, start_date=None, end_date=None):
+    """pandas equivalent of row_predicate, for frames read without the store."""
+    mask = pd.Series(True, index=df.index)
+    if ts_codes is not None:
+        mask &= df['ts_code'].isin([str(code) for code in ts_codes])
+    if start_date is not None:
+        mask &= df['date'] >= pd.Timestamp(start_date)
+    if end_date is not None:
+        mask &= df['date'] <= pd.Timestamp(end_date)
+    return df if mask.all() else df[mask]
+
+
+def _stock_row_groups(stock_ids, target_rows):
+    """
+    Pack whole stocks into row groups of about target_rows rows, so a stock
+    never straddles two groups. Returns (start, stop) row ranges.
+    """
+    starts = _run_starts(stock_ids)
+    stops = np.r_[starts[1:], len(stock_ids)]
+    groups = []
+    group_start = 0
+    for start, stop in zip(starts, stops):
+        if start > group_start and stop - group_start > target_rows:
+            groups.append((group_start, int(start)))
+            group_start = int(start)
+    if len(stock_ids) > group_start:
+        groups.append((group_start, len(stock_ids)))
+    return groups
+
+
+def _stable_schema(schema):
+    """
+    Arrow schema for writing a file chunk by chunk: dictionary (categorical)
+    columns get 32-bit indices and all-null columns are typed as strings,
+    so every chunk can be cast to it.
+    """
+    fields = []
+    for field in schema:
+        if pa.types.is_dictionary(field.type):
+            field = field.with_type(pa.dictionary(pa.int32(), field.type.value_type))
+        elif pa.types.is_null(field.type):
+            field = field.with_type(pa.string())
+        fields.append(field)
+    return pa.schema(fields, metadata=schema.metadata)
+
+
+def default_cache_dir(csv_path):
+    """
+    Cache directory for a source CSV, e.g. src/stock_data.csv -> src/.cache/stock_data/
+    """
+    csv_path = os.path.abspath(csv_path)
+    stem = os.path.splitext(os.path.basename(csv_path))[0]
+    return os.path.join(os.path.dirname(csv_path), CACHE_DIRNAME, stem)
+
+
+def file_sha256(path, block_size=1 << 20):
+    """Content hash of a file, read in 1 MB blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_fingerprint(path):
+    """Size, mtime and content hash used to key the cache on its source file."""
+    stat = os.stat(path)
+    return {
+        'path': os.path.abspath(path),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha256': file_sha256(path),
+    }
+
+
+def _write_json_atomic(path, payload):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(payload, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+class DatasetStore:
+    """
+    Columnar (Parquet) copy of the stock CSV.
+
+    The CSV is converted once on first load and re-used until the source file
+    changes. Freshness is checked against the size/mtime recorded in the
+    manifest; when only the mtime differs the content hash decides, so a
+    touched-but-unchanged file does not trigger a rebuild.
+    """
+    def __init__(self, csv_path, cache_dir=None):
+        self.csv_path = csv_path
+        self.cache_dir = cache_dir or default_cache_dir(csv_path)
+        self.manifest_path = os.path.join(self.cache_dir, MANIFEST_NAME)
+        self.prices_path = os.path.join(self.cache_dir, PRICES_NAME)
+        self.news_path = os.path.join(self.cache_dir, NEWS_NAME)
+        self.delta_dir = os.path.join(self.cache_dir, DELTA_DIRNAME)
+
+    @staticmethod
+    def available():
+        """True when pyarrow is installed and the Parquet cache can be used."""
+        return pq is not None
+
+    def read_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return None
+        with open(self.manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def is_fresh(self):
+        manifest = self.read_manifest()
+        if manifest is None or manifest.get('version') != CACHE_VERSION:
+            return False
+        if not os.path.exists(self.prices_path):
+            return False
+
+        source = manifest['source']
+        stat = os.stat(self.csv_path)
+        if source['size'] != stat.st_size:
+            return False
+        if source['mtime_ns'] == stat.st_mtime_ns:
+            return True
+
+        # Same size but a different mtime: only the content hash can tell.
+        if file_sha256(self.csv_path) != source['sha256']:
+            return False
+        source['mtime_ns'] = stat.st_mtime_ns
+        _write_json_atomic(self.manifest_path, manifest)
+        return True
+
+    def build(self, chunk_rows=ROW_GROUP_SIZE):
+        """
+        Convert the source CSV to Parquet, reading it chunk_rows rows at a
+        time, so the CSV never has to fit in memory. Ingested deltas are
+        kept and still applied on top of the rebuilt base.
+        """
+        print(f"Building columnar cache for {self.csv_path} ...")
+        deltas = (self.read_manifest() or {}).get('deltas', [])
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        # Row groups hold whole stocks, and the manifest indexes which stocks
+        # and dates each one covers, so filtered reads can skip groups.
+        row_groups = []
+        columns = None
+        rows = 0
+        raw_bytes = compact_bytes = 0
+        writer = None
+        tmp_path = self.prices_path + '.tmp'
+
+        def write(group):
+            nonlocal writer, columns, rows, compact_bytes
+            group = apply_dtype_plan(group.reset_index(drop=True))
+            table = pa.Table.from_pandas(group, preserve_index=False)
+            if writer is None:
+                columns = group.columns.tolist()
+                writer = pq.ParquetWriter(tmp_path, _stable_schema(table.schema))
+            # Chunks can differ in dictionary width or all-null columns; the first one fixes the schema
+            writer.write_table(table.cast(writer.schema))
+            row_groups.append({
+                'stocks': [str(code) for code in pd.unique(group['ts_code'])],
+                'first_date': str(group['date'].min()),
+                'last_date': str(group['date'].max()),
+            })
+            rows += len(group)
+            compact_bytes += group.memory_usage(deep=True).sum()
+
+        try:
+            pending = None
+            for chunk in pd.read_csv(self.csv_path, chunksize=chunk_rows):
+                raw_bytes += chunk.memory_usage(deep=True).sum()
+                pending = chunk if pending is None else pd.concat([pending, chunk], ignore_index=True)
+                if len(pending) <= ROW_GROUP_SIZE:
+                    continue
+                groups = _stock_row_groups(pd.factorize(pending['ts_code'])[0], ROW_GROUP_SIZE)
+                # The last group's stock may continue in the next chunk
+                for start, stop in groups[:-1]:
+                    write(pending.iloc[start:stop])
+                pending = pending.iloc[groups[-1][0]:]
+            if pending is None:
+                pending = pd.read_csv(self.csv_path, nrows=0)
+            for start, stop in _stock_row_groups(pd.factorize(pending['ts_code'])[0], ROW_GROUP_SIZE):
+                write(pending.iloc[start:stop])
+            if writer is None:
+                # No rows: an empty file with the CSV's columns
+                empty = apply_dtype_plan(pending.iloc[0:0])
+                columns = empty.columns.tolist()
+                schema = pa.Table.from_pandas(empty, preserve_index=False).schema
+                writer = pq.ParquetWriter(tmp_path, _stable_schema(schema))
+        finally:
+            if writer is not None:
+                writer.close()
+        os.replace(tmp_path, self.prices_path)
+        print(f"Compact dtypes: {raw_bytes / 1e6:.1f} MB -> {compact_bytes / 1e6:.1f} MB "
+              f"({1 - compact_bytes / max(raw_bytes, 1):.0%} saved)")
+
+        _write_json_atomic(self.manifest_path, {
+            'version': CACHE_VERSION,
+            'source': file_fingerprint(self.csv_path),
+            'rows': rows,
+            'columns': columns,
+            'row_groups': row_groups,
+            'deltas': deltas,
+        })
+        print(f"Cached {rows} rows to {self.prices_path}")
+
+    def ensure(self):
+        """Build the cache if it is missing or stale."""
+        if not self.is_fresh():
+            self.build()
+        return self
+
+    def columns(self):
+        """Column names of the cached dataset, in file order."""
+        return pq.read_schema(self.prices_path).names
+
+    def select_row_groups(self, ts_codes=None, start_date=None, end_date=None):
+        """Indices of the row groups that can hold rows matching the filters."""
+        codes = None if ts_codes is None else {str(code) for code in ts_codes}
+        start = None if start_date is None else pd.Timestamp(start_date)
+        end = None if end_date is None else pd.Timestamp(end_date)
+        selected = []
+        for i, group in enumerate(self.read_manifest()['row_groups']):
+            if codes is not None and codes.isdisjoint(group['stocks']):
+                continue
+            if start is not None and pd.Timestamp(group['last_date']) < start:
+                continue
+            if end is not None and pd.Timestamp(group['first_date']) > end:
+                continue
+            selected.append(i)
+        return selected
+
+    def read(self, columns=None, ts_codes=None, start_date=None, end_date=None):
+        """
+        Read the cached dataset, optionally projecting to a subset of columns
+        and restricting rows to a stock universe and an inclusive date range.
+
+        Only the requested column chunks of the row groups that can match
+        (per the manifest's row-group index) are read from disk; remaining
+        rows are filtered in Arrow before conversion to pandas.
+        """
+        predicate = row_predicate(ts_codes, start_date, end_date)
+        deltas = self.deltas()
+        read_cols = columns
+        if (deltas or predicate is not None) and columns is not None:
+            # Filtering and merging deltas need the row key even if the caller did not ask for it.
+            read_cols = [col for col in ROW_KEY if col not in columns] + list(columns)
+
+        if predicate is None:
+            table = pq.read_table(self.prices_path, columns=read_cols)
+        else:
+            groups = self.select_row_groups(ts_codes, start_date, end_date)
+            parquet_file = pq.ParquetFile(self.prices_path)
+            if groups:
+                table = parquet_file.read_row_groups(groups, columns=read_cols).filter(predicate)
+            else:
+                schema = parquet_file.schema_arrow
+                table = schema.empty_table().select(read_cols or schema.names)
+        df = table.to_pandas()
+
+        if deltas:
+            df = merge_rows(df, self.read_deltas(columns=read_cols, filters=predicate))
+        if read_cols is not columns:
+            df = df[list(columns)]
+        return df
+
+    def iter_batches(self, columns=None, batch_rows=ROW_GROUP_SIZE, row_groups=None):
+        """
+        Yield the base (CSV) rows as DataFrames of at most batch_rows rows,
+        in file order, optionally from selected row groups only. Ingested
+        deltas are not included; see read_deltas.
+        """
+        parquet_file = pq.ParquetFile(self.prices_path)
+        for batch in parquet_file.iter_batches(batch_size=batch_rows, columns=columns, row_groups=row_groups):
+            yield batch.to_pandas()
+
+    def deltas(self):
+        """Manifest entries of the ingested delta files, oldest first."""
+        return (self.read_manifest() or {}).get('deltas', [])
+
+    def watermark(self):
+        """Sequence number of the latest ingested delta (0 before any ingest)."""
+        deltas = self.deltas()
+        return deltas[-1]['seq'] if deltas else 0
+
+    def ingest(self, delta_df):
+        """
+        Append one delta (e.g. a trading day's rows) to the store.
+
+        Rows are deduplicated on (ts_code, date), the last occurrence winning,
+        and written as a new Parquet file; the base file is not rewritten.
+
+        Returns:
+            int: The new watermark (delta sequence number).
+        """
+        manifest = self.read_manifest()
+        expected = manifest['columns']
+        missing = set(expected).difference(delta_df.columns)
+        unexpected = set(delta_df.columns).difference(expected)
+        if missing or unexpected:
+            raise ValueError(f"Delta columns do not match the dataset: missing {sorted(missing)}, "
+                             f"unexpected {sorted(unexpected)}")
+
+        delta_df = apply_dtype_plan(delta_df[expected])
+        delta_df = delta_df.drop_duplicates(subset=ROW_KEY, keep='last').reset_index(drop=True)
+
+        seq = self.watermark() + 1
+        os.makedirs(self.delta_dir, exist_ok=True)
+        filename = f"delta-{seq:06d}.parquet"
+        path = os.path.join(self.delta_dir, filename)
+        pq.write_table(pa.Table.from_pandas(delta_df, preserve_index=False), path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+        manifest['deltas'] = manifest.get('deltas', []) + [{
+            'seq': seq,
+            'file': filename,
+            'rows': len(delta_df),
+            'first_date': str(delta_df['date'].min()),
+            'last_date': str(delta_df['date'].max()),
+        }]
+        _write_json_atomic(self.manifest_path, manifest)
+        return seq
+
+    def read_deltas(self, since=0, columns=None, filters=None):
+        """
+        Rows of the deltas ingested after watermark `since`, deduplicated on
+        (ts_code, date) with the newest delta winning. None if there are none.
+        """
+        frames = [
+            pq.read_table(os.path.join(self.delta_dir, entry['file']),
+                          columns=columns, filters=filters).to_pandas()
+            for entry in self.deltas() if entry['seq'] > since
+        ]
+        if not frames:
+            return None
+        delta_df = pd.concat(frames, ignore_index=True)
+        if set(ROW_KEY).issubset(delta_df.columns):
+            delta_df = delta_df.drop_duplicates(subset=ROW_KEY, keep='last').reset_index(drop=True)
+        return apply_dtype_plan(delta_df)
+
+    def news_is_fresh(self):
+        """True when news.parquet was built from the current prices and deltas."""
+        manifest = self.read_manifest()
+        news = (manifest or {}).get('news')
+        return (news is not None and os.path.exists(self.news_path)
+                and news['source_sha256'] == manifest['source']['sha256']
+                and news.get('watermark', 0) == self.watermark())
+
+    def write_news(self, news_frames, stocks):
+        """
+        Write the long-format news table from one or more frames (together
+        sorted by stock_id and date), and record the stock_id -> ts_code
+        mapping it was built with. `stocks` is only read once the frames
+        are written, so a generator of per-stock frames can fill it in.
+        """
+        if isinstance(news_frames, pd.DataFrame):
+            news_frames = [news_frames]
+        tmp_path = self.news_path + '.tmp'
+        writer = None
+        rows = 0
+        buffered = []
+
+        def flush():
+            nonlocal writer, rows
+            frame = pd.concat(buffered, ignore_index=True)
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, _stable_schema(table.schema))
+            writer.write_table(table.cast(writer.schema), row_group_size=ROW_GROUP_SIZE)
+            rows += len(frame)
+            buffered.clear()
+
+        try:
+            # Per-stock frames are small: batch them into row groups of about ROW_GROUP_SIZE rows
+            for frame in news_frames:
+                buffered.append(frame)
+                if sum(len(frame) for frame in buffered) >= ROW_GROUP_SIZE:
+                    flush()
+            if buffered or writer is None:
+                if not buffered:
+                    buffered.append(pd.DataFrame({'stock_id': pd.Series(dtype='int32'),
+                                                  'date': pd.Series(dtype='datetime64[ns]'),
+                                                  'item': pd.Series(dtype='int16'),
+                                                  'text': pd.Series(dtype=pd.StringDtype('pyarrow'))}))
+                flush()
+        finally:
+            if writer is not None:
+                writer.close()
+        os.replace(tmp_path, self.news_path)
+
+        manifest = self.read_manifest()
+        manifest['news'] = {
+            'source_sha256': manifest['source']['sha256'],
+            'watermark': self.watermark(),
+            'rows': rows,
+            'stocks': list(stocks),
+        }
+        _write_json_atomic(self.manifest_path, manifest)
+
+    def read_news(self, stock_id=None):
+        """
+        Read the news table with its text column as Arrow-backed strings;
+        with stock_id, only that stock's rows (the table is sorted by
+        stock_id, so row-group statistics skip the other stocks' groups).
+        """
+        filters = None if stock_id is None else [('stock_id', '=', stock_id)]
+        table = pq.read_table(self.news_path, filters=filters)
+        news_df = table.to_pandas(types_mapper={pa.string(): pd.StringDtype('pyarrow')}.get)
+        return news_df, self.read_manifest()['news']['stocks']
+
+
+def _run_starts(ids):
+    """Start positions of each run of equal values in a 1-D array."""
+    if len(ids) == 0:
+        return np.empty(0, dtype=np.int64)
+    return np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+
+
+class StockPartitions:
+    """
+    Per-stock row ranges over a frame grouped by ts_code.
+
+    The frame is grouped once (a stable reorder, and only if a stock's rows
+    are not already contiguous); after that each stock is a [start, stop)
+    range, so looking one up is a dict access plus an iloc slice that does
+    not copy the underlying columns.
+    """
+    def __init__(self, frame, bounds, key='ts_code'):
+        self.frame = frame
+        self.key = key
+        self._bounds = bounds
+
+    @classmethod
+    def from_frame(cls, df, key='ts_code'):
+        # factorize numbers stocks in order of first appearance, matching df[key].unique()
+        ids, uniques = pd.factorize(df[key])
+        runs = _run_starts(ids)
+        if len(runs) != len(uniques):
+            # Some stock's rows are interleaved with others: group them, keeping date order.
+            order = np.argsort(ids, kind='stable')
+            df = df.iloc[order].reset_index(drop=True)
+            ids = ids[order]
+            runs = _run_starts(ids)
+        stops = np.r_[runs[1:], len(ids)]
+        bounds = {uniques[ids[start]]: (int(start), int(stop)) for start, stop in zip(runs, stops)}
+        return cls(df, bounds, key=key)
+
+    @property
+    def stocks(self):
+        return list(self._bounds)
+
+    def bounds(self, stock):
+        """(start, stop) row range of a stock in self.frame."""
+        return self._bounds[stock]
+
+    def __getitem__(self, stock):
+        start, stop = self._bounds[stock]
+        return self.frame.iloc[start:stop]
+
+    def __contains__(self, stock):
+        return stock in self._bounds
+
+    def __len__(self):
+        return len(self._bounds)
+
+    def __iter__(self):
+        """Yield (ts_code, frame slice) pairs in order of first appearance."""
+        for stock, (start, stop) in self._bounds.items():
+            yield stock, self.frame.iloc[start:stop]
+
+
+class NewsTable:
+    """
+    One row per news item: (stock_id, date, item, text), sorted by stock_id
+    and date, with `stocks[stock_id]` giving the ts_code.
+
+    Keeping news out of the price frame means the price columns stay plain
+    numeric arrays, and a stock's news is a contiguous slice found with a
+    binary search on stock_id rather than a Python loop over parsed objects.
+    """
+    def __init__(self, frame, stocks):
+        self.frame = frame
+        self.stocks = list(stocks)
+        self._ids = {code: i for i, code in enumerate(self.stocks)}
+        ids = frame['stock_id'].to_numpy()
+        self._offsets = np.searchsorted(ids, np.arange(len(self.stocks) + 1))
+
+    def stock_id(self, ts_code):
+        return self._ids[ts_code]
+
+    def for_stock(self, ts_code):
+        """All news rows of a stock (an iloc slice; empty if it has no news)."""
+        stock_id = self._ids.get(ts_code)
+        if stock_id is None:
+            return self.frame.iloc[0:0]
+        return self.frame.iloc[self._offsets[stock_id]:self._offsets[stock_id + 1]]
+
+    def for_dates(self, ts_code, dates):
+        """News of a stock joined against a set of dates, in (date, item) order."""
+        stock_news = self.for_stock(ts_code)
+        return stock_news[stock_news['date'].isin(dates)]
+
+    def texts(self, ts_code, dates):
+        return self.for_dates(ts_code, dates)['text'].tolist()
+
+    def __len__(self):
+        return len(self.frame)
+
+
+class StoredNews(NewsTable):
+    """
+    NewsTable over the store's news.parquet that reads one stock's news at
+    a time, for streaming evaluation: only the row groups of the requested
+    stock are read, and only the last stock's rows are kept in memory.
+    """
+    def __init__(self, store):
+        self.store = store
+        news = store.read_manifest()['news']
+        self.stocks = list(news['stocks'])
+        self._ids = {code: i for i, code in enumerate(self.stocks)}
+        self._rows = news['rows']
+        self._last = (None, None)
+
+    def for_stock(self, ts_code):
+        stock, frame = self._last
+        if stock != ts_code:
+            # Unknown stocks read no row groups and get an empty frame
+            frame, _ = self.store.read_news(stock_id=self._ids.get(ts_code, -1))
+            self._last = (ts_code, frame)
+        return frame
+
+    def __len__(self):
+        return self._rows
@@ -5,10 +5,13 @@ import torch
 import numpy as np
 import pandas as pd
 import logging
-from torch.utils.data import Dataset, DataLoader
-from model import FinReportModel
-from data_loader import load_data, split_data
-from preprocessing import select_features, normalize_features, rename_technical_columns
+from model import FinReportModel, autocast, compile_model
+from data_loader import load_data, split_data, load_news, iter_data, data_filters
+from data_store import StockPartitions
+from feature_store import open_feature_store
+from windows import WindowDataset, VariableWindowDataset, BucketedWindowLoader, make_window_loader, LABEL_LAST
+from preprocessing import (select_features, normalize_features, rename_technical_columns,
+                           FeatureSchema, ScalerStats, FEATURE_SCHEMA_PATH, SCALER_STATS_PATH)
 from report_generator import generate_html_finreport, save_html_report
 from sentiment import get_sentiment_score
 from extra_factors import (compute_market_factor, compute_size_factor, compute_valuation_factor, 
@@ -250,34 +253,73 @@ input_size  = model_config['input_size']
 hidden_size = model_config['hidden_size']
 num_layers  = model_config.get('num_layers', 1)
 dropout     = model_config.get('dropout', 0.0)
+# With min_seq_len, rows with less than seq_len rows of history (e.g. recent
+# listings) are scored with shorter, packed windows instead of being skipped
+min_seq_len = config.get('min_seq_len')
+variable_length = min_seq_len is not None
 
 # ----- Load Data and Rename Columns -----
-df = load_data(data_path)
-df = rename_technical_columns(df)
-logger.info("Columns after renaming:")
-logger.info(list(df.columns))
+streaming = config.get('streaming', False)
 
-stock_list = df['ts_code'].unique()
+# News comes from the separate news table, so prices are read without 'announcement';
+# when streaming, each stock's news is read from news.parquet as the stock comes up
+news = load_news(data_path, lazy=streaming)
+logger.info(f"Loaded {len(news)} news items for {len(news.stocks)} stocks")
+
+# Optional universe/date-range restriction, pushed down into the loader
+filters = data_filters(config)
+
+if streaming:
+    # Out-of-core: read and process one stock at a time
+    stock_frames = ((stock, rename_technical_columns(frame))
+                    for stock, frame in iter_data(data_path, by='stock', exclude=['announcement'], **filters))
+else:
+    df = load_data(data_path, exclude=['announcement'], **filters)
+    df = rename_technical_columns(df)
+    logger.info("Columns after renaming:")
+    logger.info(list(df.columns))
+
+    # Group rows by stock once; each stock is then an O(1), copy-free slice
+    stock_frames = StockPartitions.from_frame(df)
+    logger.info(f"Indexed {len(stock_frames)} stocks")
+
+# ----- Load Feature Schema and Model -----
+# The schema saved by train.py fixes the feature columns; fail early if it
+# does not match the model's input size. Older runs without one derive it
+# from the first stock.
+schema = None
+if os.path.exists(FEATURE_SCHEMA_PATH):
+    schema = FeatureSchema.load(FEATURE_SCHEMA_PATH)
+    schema.check_input_size(input_size)
+    logger.info(f"Loaded feature schema with {schema.input_size} columns from {FEATURE_SCHEMA_PATH}")
+
+# Normalization statistics fitted by train.py; without them each stock's
+# test slice is standardized on its own, as before
+scaler_stats = None
+if os.path.exists(SCALER_STATS_PATH):
+    scaler_stats = ScalerStats.load(SCALER_STATS_PATH)
+    if scaler_stats.n_features != input_size:
+        raise ValueError(f"{SCALER_STATS_PATH} covers {scaler_stats.n_features} features, "
+                         f"but model.input_size is {input_size}; retrain to refresh it.")
+    logger.info(f"Loaded scaler statistics for {len(scaler_stats.stocks)} stocks from {SCALER_STATS_PATH}")
+else:
+    logger.info(f"{SCALER_STATS_PATH} not found; normalizing each stock's test data separately")
+
+# Normalized features from the feature store train.py used, when it is still
+# fresh for this data; otherwise each stock is selected and normalized here
+store = open_feature_store(data_path, filters, per_stock=config.get('per_stock_scaling', False), build=False)
+if store is not None:
+    logger.info(f"Using feature store {store.root} ({len(store)} rows)")
 
-# ----- Load Model -----
 model = FinReportModel(input_size=input_size, hidden_size=hidden_size, num_layers=num_layers)
 model.load_state_dict(torch.load('models/finreport_model.pth'))
 model.eval()
-
-# ----- Define Dataset -----
-class FinDataset(Dataset):
-    def __init__(self, features, labels, seq_len):
-        # Truncate features and labels to the same length
-        min_len = min(len(features), len(labels))
-        self.features = features[:min_len]
-        self.labels = labels[:min_len]
-        self.seq_len = seq_len
-    def __len__(self):
-        return max(0, len(self.features) - self.seq_len)
-    def __getitem__(self, idx):
-        x = self.features[idx: idx + self.seq_len]
-        y = self.labels[idx + self.seq_len - 1]
-        return torch.tensor(x, dtype=torch.float), torch.tensor(y, dtype=torch.float)
+eager_model = model  # packed variable-length batches run eagerly
+# Optionally compiled or TorchScript-traced for the prediction loop; a traced
+# module is saved and re-used until the weights change
+model = compile_model(model, config.get('compile', 'eager'), trace_func=logger.info,
+                      example_input=torch.zeros(batch_size, seq_len, input_size),
+                      script_path='models/finreport_model.ts', weights_path='models/finreport_model.pth')
 
 # ----- Initialize Lists for Metrics and Reports -----
 all_metrics = []
@@ -288,14 +330,14 @@ all_true_values_dict = {}  # Dictionary to store true values for each stock
 os.makedirs('img', exist_ok=True)
 
 # ----- Process Each Stock -----
-for stock in stock_list:
+for stock, df_stock in stock_frames:
     logger.info(f"Processing stock: {stock}")
-    df_stock = df[df['ts_code'] == stock]
     
     row_count = len(df_stock)
     logger.info(f"Stock {stock} has {row_count} rows.")
-    if row_count <= seq_len:
-        logger.info(f"Not enough data for stock {stock} (requires > {seq_len} rows). Skipping.")
+    min_rows = min_seq_len if variable_length else seq_len + 1
+    if row_count < min_rows:
+        logger.info(f"Not enough data for stock {stock} (requires >= {min_rows} rows). Skipping.")
         continue
 
     latest_val = df_stock['market_value'].iloc[-1]
@@ -307,25 +349,64 @@ for stock in stock_list:
     # Prepare training data 
     train_df, _ = split_data(df_stock, train_ratio=0.6)
 
-    if len(test_df) <= seq_len:
+    if len(test_df) == 0 or (not variable_length and len(test_df) <= seq_len):
         logger.info(f"Not enough test data for stock {stock} (requires > {seq_len} rows). Skipping.")
         continue
 
-    test_features, test_labels = select_features(test_df)
-    logger.info("Shape of features: " + str(test_features.shape))
-    logger.info("First row of features: " + str(test_features[0]))
-    test_features, scaler = normalize_features(test_features)
-    dataset = FinDataset(test_features, test_labels, seq_len)
+    split = row_count - len(test_df)
+    stock_rows = store.rows(stock) if store is not None and stock in store else None
+    if stock_rows is not None and stock_rows.stop - stock_rows.start == row_count:
+        # Rows of the store are already selected and normalized
+        stock_features, stock_labels = store.stock(stock)
+        test_features, test_labels = stock_features[split:], stock_labels[split:]
+        logger.info("Shape of features: " + str(test_features.shape))
+    else:
+        if schema is None:
+            schema = FeatureSchema.from_frame(df_stock)
+            schema.check_input_size(input_size)
+        # Variable-length windows reach back into the training rows for history
+        stock_features, stock_labels = select_features(df_stock if variable_length else test_df, schema)
+        logger.info("Shape of features: " + str(stock_features.shape))
+        logger.info("First row of features: " + str(stock_features[0]))
+        if scaler_stats is not None:
+            stock_features = scaler_stats.transform(stock_features, stock)
+        else:
+            stock_features, _ = normalize_features(stock_features)
+        test_features, test_labels = stock_features, stock_labels
+        if variable_length:
+            test_features, test_labels = stock_features[split:], stock_labels[split:]
+    if variable_length:
+        # Every test row with at least min_seq_len rows of history, in windows of up to seq_len rows
+        dataset = VariableWindowDataset(stock_features, stock_labels, seq_len,
+                                        targets=np.arange(split, row_count), min_len=min_seq_len)
+    else:
+        dataset = WindowDataset(test_features, test_labels, seq_len, label=LABEL_LAST)
     if len(dataset) <= 0:
         logger.info(f"Dataset for stock {stock} is empty after processing. Skipping.")
         continue
 
-    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False)
     all_predictions = []
     with torch.no_grad():
-        for x_batch, _ in loader:
-            preds = model(x_batch)
-            all_predictions.extend(preds.cpu().numpy().flatten())
+        if variable_length:
+            # Batches of similar window lengths; full-length batches take the (compiled) fixed-window path
+            loader = BucketedWindowLoader(dataset, batch_size)
+            logger.info(f"{int((dataset.lengths < seq_len).sum())} of {len(dataset)} windows are shorter than "
+                        f"{seq_len} rows; padding {loader.padding_ratio():.1%}")
+            for x_batch, _, lengths in loader:
+                with autocast(x_batch.device, config.get('mixed_precision', False)):
+                    if x_batch.size(1) == seq_len and bool((lengths == seq_len).all()):
+                        preds = model(x_batch)
+                    else:
+                        preds = eager_model(x_batch, lengths)
+                all_predictions.append(preds.cpu().numpy())
+            # Back from length order to row order
+            all_predictions = np.concatenate(all_predictions)[np.argsort(loader.order)]
+        else:
+            loader = make_window_loader(dataset, batch_size, shuffle=False, batched=config.get('batched_loader', True))
+            for x_batch, _ in loader:
+                with autocast(x_batch.device, config.get('mixed_precision', False)):
+                    preds = model(x_batch)
+                all_predictions.extend(preds.cpu().numpy().flatten())
     all_predictions = np.array(all_predictions)
 
     # Log prediction statistics
@@ -334,7 +415,10 @@ for stock in stock_list:
     predicted_return = all_predictions[0]
 
     # Get the true labels corresponding to predictions
-    true_labels = test_labels[seq_len-1:seq_len-1+len(all_predictions)]
+    if variable_length:
+        true_labels = stock_labels[dataset.targets]
+    else:
+        true_labels = test_labels[seq_len-1:seq_len-1+len(all_predictions)]
     
     # Log first few predictions and true values
     logger.info(f"First 10 Predictions for {stock}: {all_predictions[:10]}")
@@ -376,7 +460,8 @@ for stock in stock_list:
         'R2': r2_value
     })
 
-    news_summary = str(test_df.iloc[-1]["announcement"])
+    # Join the stock's news against the last test date
+    news_summary = " ".join(news.texts(stock, [test_df['date'].iloc[-1]]))
     sentiment_score = get_sentiment_score(news_summary)
     logger.info(f"Sentiment Score for {stock}: {sentiment_score:.4f}")
     news_source = "财联社"
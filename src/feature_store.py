@@ -0,0 +1,240 @@
+# src/feature_store.py
+import os
+import json
+from itertools import chain
+import numpy as np
+
+from data_loader import group_stock_frames, iter_data, load_data
+from data_store import DatasetStore, StockPartitions, default_cache_dir, _write_json_atomic
+from preprocessing import FeatureSchema, ScalerStats, StreamingScaler, iter_features
+
+FEATURE_STORE_VERSION = 2
+FEATURE_STORE_DIRNAME = 'features'
+MANIFEST_NAME = 'manifest.json'
+FEATURES_NAME = 'features.npy'
+LABELS_NAME = 'labels.npy'
+STOCKS_NAME = 'stocks.npy'
+OFFSETS_NAME = 'offsets.npy'
+STATS_NAME = 'scaler_stats.npz'
+TRAIN_RATIO = 0.6  # split_data's default: statistics are fitted on the leading rows
+
+
+def default_store_dir(csv_path):
+    """Feature store directory inside the dataset's cache directory."""
+    return os.path.join(default_cache_dir(csv_path), FEATURE_STORE_DIRNAME)
+
+
+def source_key(csv_path):
+    """
+    Identity of the data a store was built from: the CSV's size and mtime
+    plus the delta watermark, so an edited CSV or a new ingest invalidates it.
+    """
+    stat = os.stat(csv_path)
+    store = DatasetStore(csv_path)
+    watermark = store.watermark() if store.available() else 0
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'watermark': watermark}
+
+
+def _save_atomic(path, array):
+    tmp_path = path + '.tmp.npy'
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+
+class FeatureStore:
+    """
+    The normalized model inputs on disk: the float32 feature matrix, the
+    labels and a per-stock row-offset index as .npy files, plus the schema
+    and scaler statistics they were built with.
+
+    Opening the store memory-maps the arrays, so a process starts without
+    re-running load -> rename -> select -> normalize, and processes reading
+    the same store share one page-cache copy. Rows
+    are grouped by stock; stock i occupies rows offsets[i]:offsets[i + 1].
+    """
+    def __init__(self, root):
+        self.root = root
+        self.manifest_path = os.path.join(root, MANIFEST_NAME)
+        self.features = None
+        self.labels = None
+        self.stocks = None
+        self.offsets = None
+        self.schema = None
+        self.stats = None
+        self._stock_index = {}
+
+    def _path(self, name):
+        return os.path.join(self.root, name)
+
+    def read_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return None
+        with open(self.manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def is_fresh(self, key):
+        """True when the store was built for `key` (see open_feature_store)."""
+        manifest = self.read_manifest()
+        return (manifest is not None and manifest.get('version') == FEATURE_STORE_VERSION
+                and manifest.get('key') == key)
+
+    def create(self, rows, n_features):
+        """
+        Start a build: drop the manifest (so a partial build is never
+        fresh) and return writable (features, labels) float32 memmaps,
+        filled by the caller and moved into place by commit().
+        """
+        os.makedirs(self.root, exist_ok=True)
+        if os.path.exists(self.manifest_path):
+            os.remove(self.manifest_path)
+        features = np.lib.format.open_memmap(self._path(FEATURES_NAME) + '.tmp.npy', mode='w+',
+                                             dtype=np.float32, shape=(rows, n_features))
+        labels = np.lib.format.open_memmap(self._path(LABELS_NAME) + '.tmp.npy', mode='w+',
+                                           dtype=np.float32, shape=(rows,))
+        return features, labels
+
+    def commit(self, stocks, offsets, schema, stats, key):
+        """
+        Move the arrays filled since create() into place, then write the
+        manifest (last, so a partial write is never fresh). The caller must
+        have flushed and released its memmaps.
+        """
+        for name in (FEATURES_NAME, LABELS_NAME):
+            os.replace(self._path(name) + '.tmp.npy', self._path(name))
+        _save_atomic(self._path(STOCKS_NAME), np.asarray(stocks, dtype=str))
+        _save_atomic(self._path(OFFSETS_NAME), np.asarray(offsets, dtype=np.int64))
+        stats.save(self._path(STATS_NAME))
+        _write_json_atomic(self.manifest_path, {
+            'version': FEATURE_STORE_VERSION,
+            'key': key,
+            'rows': int(offsets[-1]),
+            'schema': schema.to_dict(),
+        })
+
+    def open(self, mmap_mode='c'):
+        """
+        Memory-map the arrays and load the schema and scaler statistics.
+
+        The default copy-on-write mapping shares clean pages exactly like
+        mmap_mode='r', but gives writable arrays, which torch.as_tensor
+        expects; any write stays private to the process and never reaches
+        the files.
+        """
+        manifest = self.read_manifest()
+        if manifest is None:
+            raise RuntimeError(f"No feature store at {self.root}")
+        self.features = np.load(self._path(FEATURES_NAME), mmap_mode=mmap_mode)
+        self.labels = np.load(self._path(LABELS_NAME), mmap_mode=mmap_mode)
+        self.stocks = np.load(self._path(STOCKS_NAME))
+        self.offsets = np.load(self._path(OFFSETS_NAME))
+        self.schema = FeatureSchema(**manifest['schema'])
+        self.stats = ScalerStats.load(self._path(STATS_NAME))
+        self._stock_index = {stock: i for i, stock in enumerate(self.stocks.tolist())}
+        return self
+
+    def __len__(self):
+        return len(self.features)
+
+    def __contains__(self, stock):
+        return str(stock) in self._stock_index
+
+    def train_rows(self, train_ratio=TRAIN_RATIO):
+        """Number of leading rows in the training split (as split_data)."""
+        return int(len(self) * train_ratio)
+
+    def rows(self, stock):
+        """Row range of a stock as a slice."""
+        i = self._stock_index[str(stock)]
+        return slice(int(self.offsets[i]), int(self.offsets[i + 1]))
+
+    def stock(self, stock):
+        """(features, labels) views of one stock's rows."""
+        rows = self.rows(stock)
+        return self.features[rows], self.labels[rows]
+
+
+def build_feature_store(csv_path, filters=None, per_stock=False, root=None, key=None):
+    """
+    Load, rename, select and normalize the dataset a batch of stocks at a
+    time and write the result to a FeatureStore, so the dataset never has to fit in
+    memory. The global scaler statistics are fitted on the training split
+    (the leading TRAIN_RATIO of rows), as train.py does. With per_stock,
+    each stock's statistics are fitted on the leading TRAIN_RATIO of that
+    stock's own rows, so every stock gets its own row, including the stocks
+    that lie past the global split; only stocks too short to have a
+    training row (and stocks outside the store) use the global statistics.
+
+    Args:
+        csv_path (str): Source CSV.
+        filters (dict): ts_codes/start_date/end_date, as from data_loader.data_filters.
+        per_stock (bool): Normalize with per-ts_code statistics.
+        root (str): Store directory (default: next to the dataset cache).
+    """
+    filters = filters or {}
+    store = FeatureStore(root or default_store_dir(csv_path))
+    print(f"Building feature store in {store.root} ...")
+    try:
+        # Stock order and row counts from the ts_code column alone
+        counts = [len(frame) for _, frame in iter_data(csv_path, by='stock', columns=['ts_code'], **filters)]
+        stock_frames = iter_data(csv_path, by='stock', exclude=['announcement'], **filters)
+    except ValueError:
+        # Some stock's rows are not contiguous in the source: group them in memory
+        partitions = StockPartitions.from_frame(load_data(csv_path, exclude=['announcement'], **filters))
+        counts = [len(frame) for _, frame in partitions]
+        stock_frames = iter(partitions)
+    offsets = np.cumsum([0] + counts, dtype=np.int64)
+    split = int(offsets[-1] * TRAIN_RATIO)
+
+    first = next(stock_frames, None)
+    if first is None:
+        raise ValueError(f"No rows in {csv_path} match the filters {filters}")
+    schema = FeatureSchema.from_frame(first[1])
+    arrays = dict(zip(('features', 'labels'), store.create(int(offsets[-1]), schema.input_size)))
+    stocks = []
+    total = StreamingScaler()
+    stock_scalers = {}
+
+    # Features are selected a batch of stocks at a time; each stock's rows are written,
+    # and its leading rows are folded into the statistics
+    batches = group_stock_frames(chain([first], stock_frames))
+    for batch_stocks, features, labels in iter_features(batches, schema):
+        batch_start = offsets[len(stocks)]
+        arrays['features'][batch_start:batch_start + len(features)] = features
+        arrays['labels'][batch_start:batch_start + len(labels)] = labels
+        for stock in batch_stocks:
+            start, stop = offsets[len(stocks)], offsets[len(stocks) + 1]
+            stocks.append(str(stock))
+            rows = features[start - batch_start:stop - batch_start]
+            total.partial_fit(rows[:max(0, min(stop, split) - start)])
+            if per_stock:
+                stock_scalers[str(stock)] = StreamingScaler().partial_fit(rows[:int(len(rows) * TRAIN_RATIO)])
+
+    stats = ScalerStats.from_scalers(total, stock_scalers, per_stock=per_stock)
+    for stock, start, stop in zip(stocks, offsets[:-1], offsets[1:]):
+        stats.transform(arrays['features'][start:stop], stock)
+    for array in arrays.values():
+        array.flush()
+    arrays.clear()
+
+    store.commit(stocks, offsets, schema, stats, key or source_key(csv_path))
+    print(f"Stored {int(offsets[-1])} rows x {schema.input_size} features for {len(stocks)} stocks")
+    return store
+
+
+def open_feature_store(csv_path, filters=None, per_stock=False, root=None, build=True):
+    """
+    Memory-map the feature store for a dataset, (re)building it first when
+    it is missing or was built from other data, filters or scaling.
+
+    Returns:
+        FeatureStore, or None when the store is stale and build is False.
+    """
+    # Round-trip through JSON so the key compares equal to the one in the manifest
+    key = json.loads(json.dumps(dict(source_key(csv_path), filters=filters or {}, per_stock=bool(per_stock)),
+                                default=str))
+    store = FeatureStore(root or default_store_dir(csv_path))
+    if not store.is_fresh(key):
+        if not build:
+            return None
+        store = build_feature_store(csv_path, filters, per_stock=per_stock, root=store.root, key=key)
+    return store.open()
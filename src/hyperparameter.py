@@ -1,49 +1,65 @@
 import os
+import math
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import yaml
 import torch
 import torch.nn as nn
 import torch.optim as optim
 import numpy as np
-from torch.utils.data import Dataset, DataLoader
 from sklearn.model_selection import TimeSeriesSplit
-from model import FinReportModel
-from data_loader import load_data
-from preprocessing import select_features, normalize_features
+from model import FinReportModel, autocast, compile_model
+from data_loader import data_filters
+from feature_store import FeatureStore, open_feature_store
+from windows import WindowDataset, make_window_loader, slice_offsets, LABEL_NEXT
 from tqdm import tqdm
 
-# Define a simple dataset for sequence data
-class FinDataset(Dataset):
-    def __init__(self, features, labels, seq_len):
-        self.features = features
-        self.labels = labels
-        self.seq_len = seq_len
+def _is_range(idx):
+    return len(idx) > 0 and idx[-1] - idx[0] + 1 == len(idx)
 
-    def __len__(self):
-        return max(0, len(self.features) - self.seq_len)
+def _take(array, idx):
+    """Index rows; contiguous index ranges (as from TimeSeriesSplit) are sliced as views."""
+    if _is_range(idx):
+        return array[idx[0]:idx[-1] + 1]
+    return array[idx]
 
-    def __getitem__(self, idx):
-        x = self.features[idx: idx + self.seq_len]
-        y = self.labels[idx + self.seq_len]
-        return torch.tensor(x, dtype=torch.float), torch.tensor(y, dtype=torch.float)
+def _fold_offsets(offsets, idx):
+    """Stock boundaries within a contiguous fold (None when unknown)."""
+    if offsets is None or not _is_range(idx):
+        return None
+    return slice_offsets(offsets, idx[0], idx[-1] + 1)
 
 # Function to create DataLoaders given training and validation indices
-def create_dataloaders(features, labels, seq_len, batch_size, train_idx, val_idx, num_workers=2):
-    train_features = features[train_idx]
-    train_labels = labels[train_idx]
-    val_features = features[val_idx]
-    val_labels = labels[val_idx]
+def create_dataloaders(features, labels, seq_len, batch_size, train_idx, val_idx, num_workers=2, offsets=None,
+                       batched=True, resident_mb=0):
+    train_features = _take(features, train_idx)
+    train_labels = _take(labels, train_idx)
+    val_features = _take(features, val_idx)
+    val_labels = _take(labels, val_idx)
     
-    train_dataset = FinDataset(train_features, train_labels, seq_len)
-    val_dataset = FinDataset(val_features, val_labels, seq_len)
+    # Each window is labelled with the row that follows it; with stock
+    # offsets, windows that would span two stocks are left out
+    train_dataset = WindowDataset(train_features, train_labels, seq_len, label=LABEL_NEXT,
+                                  offsets=_fold_offsets(offsets, train_idx))
+    val_dataset = WindowDataset(val_features, val_labels, seq_len, label=LABEL_NEXT,
+                                offsets=_fold_offsets(offsets, val_idx))
     
-    train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True, num_workers=num_workers)
-    val_loader = DataLoader(val_dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+    # Batched loaders gather in-process; num_workers only applies to the DataLoader path
+    train_loader = make_window_loader(train_dataset, batch_size, shuffle=True, batched=batched,
+                                      resident_mb=resident_mb, num_workers=num_workers)
+    val_loader = make_window_loader(val_dataset, batch_size, shuffle=False, batched=batched,
+                                    resident_mb=resident_mb, num_workers=num_workers)
     return train_loader, val_loader
 
 # Training and evaluation function with early stopping
-def train_and_evaluate(train_loader, val_loader, input_size, hidden_size, num_layers, dropout, learning_rate, num_epochs, device, patience=5):
+# (history, when given, receives the validation loss of every epoch trained)
+def train_and_evaluate(train_loader, val_loader, input_size, hidden_size, num_layers, dropout, learning_rate, num_epochs, device, patience=5,
+                       mixed_precision=False, compile_mode='eager', history=None):
     model = FinReportModel(input_size=input_size, hidden_size=hidden_size, num_layers=num_layers)
     model.to(device)
+    example_input = torch.zeros(train_loader.batch_size, train_loader.dataset.seq_len, input_size, device=device)
+    forward_model = compile_model(model, compile_mode, training=True, example_input=example_input)
     criterion = nn.MSELoss()
     optimizer = optim.Adam(model.parameters(), lr=learning_rate)
     
@@ -56,7 +72,8 @@ def train_and_evaluate(train_loader, val_loader, input_size, hidden_size, num_la
             x_batch = x_batch.to(device)
             y_batch = y_batch.to(device)
             optimizer.zero_grad()
-            preds = model(x_batch)
+            with autocast(device, mixed_precision):
+                preds = forward_model(x_batch)
             loss = criterion(preds, y_batch)
             loss.backward()
             optimizer.step()
@@ -68,10 +85,13 @@ def train_and_evaluate(train_loader, val_loader, input_size, hidden_size, num_la
             for x_batch, y_batch in val_loader:
                 x_batch = x_batch.to(device)
                 y_batch = y_batch.to(device)
-                preds = model(x_batch)
+                with autocast(device, mixed_precision):
+                    preds = forward_model(x_batch)
                 loss = criterion(preds, y_batch)
                 val_loss += loss.item()
         avg_val_loss = val_loss / len(val_loader)
+        if history is not None:
+            history.append(avg_val_loss)
         
         # Early stopping check
         if avg_val_loss < best_val_loss:
@@ -90,7 +110,8 @@ def train_and_evaluate(train_loader, val_loader, input_size, hidden_size, num_la
     return best_val_loss
 
 # Function to evaluate one hyperparameter combination over all CV folds
-def evaluate_hyperparams(hparams, features, labels, batch_size, tscv, input_size, num_epochs, device, patience=5):
+def evaluate_hyperparams(hparams, features, labels, batch_size, tscv, input_size, num_epochs, device, patience=5,
+                         offsets=None, loader_options=None, mixed_precision=False, compile_mode='eager'):
     lr = hparams['learning_rate']
     hidden = hparams['hidden_size']
     layers = hparams['num_layers']
@@ -98,10 +119,15 @@ def evaluate_hyperparams(hparams, features, labels, batch_size, tscv, input_size
     dropout = hparams['dropout']
     
     fold_losses = []
+    epochs_trained = 0
     for train_idx, val_idx in tscv.split(features):
         if len(train_idx) <= seq_len or len(val_idx) <= seq_len:
             continue
-        train_loader, val_loader = create_dataloaders(features, labels, seq_len, batch_size, train_idx, val_idx)
+        train_loader, val_loader = create_dataloaders(features, labels, seq_len, batch_size, train_idx, val_idx,
+                                                      offsets=offsets, **(loader_options or {}))
+        if len(train_loader.dataset) == 0 or len(val_loader.dataset) == 0:
+            continue
+        history = []
         avg_loss = train_and_evaluate(
             train_loader, val_loader,
             input_size=input_size,
@@ -111,37 +137,190 @@ def evaluate_hyperparams(hparams, features, labels, batch_size, tscv, input_size
             learning_rate=lr,
             num_epochs=num_epochs,
             device=device,
-            patience=patience
+            patience=patience,
+            mixed_precision=mixed_precision,
+            compile_mode=compile_mode,
+            history=history
         )
         fold_losses.append(avg_loss)
+        epochs_trained += len(history)
     avg_loss = np.mean(fold_losses) if fold_losses else None
-    return {**hparams, 'avg_val_loss': avg_loss}
+    return {**hparams, 'avg_val_loss': avg_loss, 'epochs_trained': epochs_trained}
+
+# Feature store of a search worker process, memory-mapped once per process
+_worker_store = None
+
+def _init_worker(store_root, threads):
+    """ProcessPoolExecutor initializer: pin the torch thread pools and map the shared store."""
+    global _worker_store
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+    # Every worker maps the same files, so the matrix is shared through the page cache
+    _worker_store = FeatureStore(store_root).open()
+
+def _evaluate_in_worker(hparams, search_options):
+    store = _worker_store
+    return evaluate_hyperparams(hparams, store.features, store.labels, device=torch.device('cpu'),
+                                offsets=store.offsets, **search_options)
+
+def format_leaderboard(results, top=5):
+    """The best `top` results so far, one line each."""
+    ranked = sorted(results, key=lambda x: x['avg_val_loss'])[:top]
+    lines = [f"Leaderboard ({len(results)} evaluated):"]
+    for place, r in enumerate(ranked, 1):
+        lines.append(f"  {place}. avg_val_loss {r['avg_val_loss']:.4f} | lr: {r['learning_rate']}, hidden: {r['hidden_size']}, "
+                     f"layers: {r['num_layers']}, seq_len: {r['seq_len']}, dropout: {r['dropout']}")
+    return "\n".join(lines)
+
+def parallel_search(hyperparam_combinations, store_root, workers, threads_per_worker, search_options):
+    """
+    Evaluate the combinations in a pool of worker processes (CPU only).
+
+    Each worker pins torch to threads_per_worker threads and memory-maps the
+    feature store read-only. Results are collected as they complete, with
+    the leaderboard printed after each one.
+
+    Returns:
+        list: Results of the combinations that could be evaluated.
+    """
+    results = []
+    # spawn, not fork: forking a process whose torch thread pools are running is unsafe
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                             initargs=(store_root, threads_per_worker)) as executor:
+        futures = {executor.submit(_evaluate_in_worker, hparams, search_options): hparams
+                   for hparams in hyperparam_combinations}
+        progress = tqdm(as_completed(futures), total=len(futures), desc="Hyperparameter Search")
+        for future in progress:
+            try:
+                result = future.result()
+            except Exception as e:
+                tqdm.write(f"Failed for {futures[future]}: {type(e).__name__}: {e}")
+                continue
+            if result['avg_val_loss'] is None:
+                tqdm.write("Skipped hyperparameter set due to insufficient data.")
+                continue
+            results.append(result)
+            tqdm.write(format_leaderboard(results))
+    return results
+
+SEARCH_SCHEDULERS = ('grid', 'halving', 'hyperband')
+HPARAM_KEYS = ('learning_rate', 'hidden_size', 'num_layers', 'seq_len', 'dropout')
+
+def _hparams(result):
+    return {key: result[key] for key in HPARAM_KEYS}
+
+def successive_halving(candidates, evaluate, min_epochs, max_epochs, eta=3, run_to_max=False, trace_func=print):
+    """
+    Successive halving: train every candidate for min_epochs, keep the best
+    1/eta of them, train those for eta times as many epochs, and so on until
+    max_epochs. Every rung trains from scratch through evaluate, so
+    train_and_evaluate's early stopping still ends hopeless runs early.
+    Halving stops as soon as a single candidate is left, unless run_to_max
+    is set, in which case it is still trained for max_epochs.
+
+    Args:
+        candidates (list): Hyperparameter dicts.
+        evaluate (callable): evaluate(candidates, num_epochs) -> list of evaluate_hyperparams results.
+        min_epochs (int): Budget of the first rung.
+        max_epochs (int): Budget of the last rung.
+        eta (int): Reduction factor between rungs.
+        run_to_max (bool): Always end with a max_epochs rung.
+
+    Returns:
+        tuple: (results of the last rung, best first; every result of every rung,
+        each with its epoch 'budget')
+    """
+    budget = min(min_epochs, max_epochs)
+    survivors = list(candidates)
+    history = []
+    while True:
+        results = [r for r in evaluate(survivors, budget) if r['avg_val_loss'] is not None]
+        for result in results:
+            result['budget'] = budget
+        history.extend(results)
+        results.sort(key=lambda x: x['avg_val_loss'])
+        if not results:
+            return results, history
+        trace_func(f"Rung of {len(survivors)} candidates x {budget} epochs: best avg_val_loss {results[0]['avg_val_loss']:.4f}")
+        if budget >= max_epochs or (len(results) == 1 and not run_to_max):
+            return results, history
+        survivors = [_hparams(r) for r in results[:max(1, len(results) // eta)]]
+        budget = min(budget * eta, max_epochs)
+
+def hyperband(candidates, evaluate, min_epochs, max_epochs, eta=3, seed=0, trace_func=print):
+    """
+    Hyperband: successive halving brackets that trade the number of
+    candidates for their starting budget, from many candidates at min_epochs
+    to a few trained for max_epochs from the start. Each bracket samples its
+    candidates from the grid. Every bracket ends with its survivor trained
+    for max_epochs, so the winner is picked among full-budget results.
+
+    Returns:
+        tuple: (final results of all brackets, best first; every result of every rung)
+    """
+    s_max = int(math.log(max(max_epochs / min_epochs, 1), eta) + 1e-9)
+    rng = np.random.default_rng(seed)
+    final, history = [], []
+    for s in range(s_max, -1, -1):
+        n = min(len(candidates), math.ceil((s_max + 1) / (s + 1) * eta ** s))
+        budget = max(min_epochs, int(max_epochs / eta ** s))
+        bracket = [candidates[i] for i in rng.choice(len(candidates), n, replace=False)]
+        trace_func(f"Hyperband bracket {s_max - s + 1}/{s_max + 1}: {n} candidates from {budget} epochs")
+        results, bracket_history = successive_halving(bracket, evaluate, budget, max_epochs, eta,
+                                                      run_to_max=True, trace_func=trace_func)
+        final.extend(results)
+        history.extend(bracket_history)
+    final.sort(key=lambda x: x['avg_val_loss'])
+    return final, history
+
+def report_compute_saved(history, n_candidates, n_folds, num_epochs):
+    """Epochs an adaptive search trained against the full grid's budget (every fold of every candidate for num_epochs)."""
+    trained = sum(r['epochs_trained'] for r in history)
+    full = n_candidates * n_folds * num_epochs
+    print(f"\nTrained {trained} fold-epochs in {len(history)} evaluations; the full grid budgets {full} "
+          f"({n_candidates} candidates x {n_folds} folds x {num_epochs} epochs): {1 - trained / full:.0%} of the compute saved")
 
 def main():
-    # Force use GPU if available (you have one RTX 4080, so we'll use it)
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    parser = argparse.ArgumentParser(description="Grid search over the FinReport model's hyperparameters.")
+    parser.add_argument('--config', default='src/config.yaml')
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Worker processes (default: search_workers from the config, or 1 = sequential)")
+    parser.add_argument('--threads-per-worker', type=int, default=None,
+                        help="torch threads per worker (default: the cores divided between the workers)")
+    parser.add_argument('--scheduler', choices=SEARCH_SCHEDULERS, default=None,
+                        help="Full grid, successive halving or Hyperband (default: search_scheduler from the config, or grid)")
+    args = parser.parse_args()
+
+    # Load configuration from config.yaml
+    with open(args.config, 'r') as f:
+        config = yaml.safe_load(f)
+    workers = args.workers or config.get('search_workers', 1)
+    scheduler = args.scheduler or config.get('search_scheduler', 'grid')
+    if scheduler not in SEARCH_SCHEDULERS:
+        raise ValueError(f"search_scheduler must be one of {SEARCH_SCHEDULERS}, got {scheduler!r}")
+
+    # Force use GPU if available (you have one RTX 4080, so we'll use it); parallel search runs on CPU
+    device = torch.device("cuda" if torch.cuda.is_available() and workers == 1 else "cpu")
     if device.type == "cuda":
         print(f"Using GPU: {torch.cuda.get_device_name(0)}")
     else:
         print("Using CPU")
     
-    # Load configuration from config.yaml
-    with open('src/config.yaml', 'r') as f:
-        config = yaml.safe_load(f)
-    
     data_path = config['data_path']
     batch_size = config['batch_size']
     num_epochs = config['num_epochs']
     
-    # Load and preprocess data
-    df = load_data(data_path)
-    features, labels = select_features(df)
-    features, scaler = normalize_features(features)
-    features = np.array(features)
-    labels = np.array(labels)
+    # Normalized features and labels, memory-mapped from the feature store
+    store = open_feature_store(data_path, data_filters(config), per_stock=config.get('per_stock_scaling', False))
+    features, labels = store.features, store.labels
     input_size = features.shape[1]
     
     tscv = TimeSeriesSplit(n_splits=3)
+    loader_options = {
+        'batched': config.get('batched_loader', True),
+        'resident_mb': config.get('resident_windows_mb', 0),
+    }
     
     # Define hyperparameter grids
     learning_rates = [0.001, 0.0005, 0.0001]
@@ -165,15 +344,45 @@ def main():
         for dropout in dropouts
     ]
     
-    results = []
-    # Sequential execution for GPU use
-    for hparams in tqdm(hyperparam_combinations, desc="Hyperparameter Search"):
-        result = evaluate_hyperparams(hparams, features, labels, batch_size, tscv, input_size, num_epochs, device, patience=5)
-        if result['avg_val_loss'] is not None:
-            results.append(result)
-            print(f"lr: {result['learning_rate']}, hidden: {result['hidden_size']}, layers: {result['num_layers']}, seq_len: {result['seq_len']}, dropout: {result['dropout']}, avg_val_loss: {result['avg_val_loss']:.4f}")
-        else:
-            print("Skipped hyperparameter set due to insufficient data.")
+    search_options = {
+        'batch_size': batch_size,
+        'tscv': tscv,
+        'input_size': input_size,
+        'num_epochs': num_epochs,
+        'patience': 5,
+        'loader_options': loader_options,
+        'mixed_precision': config.get('mixed_precision', False),
+        'compile_mode': config.get('compile', 'eager'),
+    }
+    
+    threads = args.threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+
+    def search(candidates, options):
+        if workers > 1:
+            print(f"Searching {len(candidates)} combinations with {workers} workers x {threads} threads")
+            return parallel_search(candidates, store.root, workers, threads, options)
+        results = []
+        # Sequential execution for GPU use
+        for hparams in tqdm(candidates, desc="Hyperparameter Search"):
+            result = evaluate_hyperparams(hparams, features, labels, device=device, offsets=store.offsets,
+                                          **options)
+            if result['avg_val_loss'] is not None:
+                results.append(result)
+                print(f"lr: {result['learning_rate']}, hidden: {result['hidden_size']}, layers: {result['num_layers']}, seq_len: {result['seq_len']}, dropout: {result['dropout']}, avg_val_loss: {result['avg_val_loss']:.4f}")
+            else:
+                print("Skipped hyperparameter set due to insufficient data.")
+        return results
+    
+    if scheduler == 'grid':
+        results = search(hyperparam_combinations, search_options)
+    else:
+        # Adaptive budgets: each rung is a search over the survivors with fewer epochs
+        schedule = successive_halving if scheduler == 'halving' else hyperband
+        results, history = schedule(hyperparam_combinations,
+                                    lambda candidates, epochs: search(candidates, dict(search_options, num_epochs=epochs)),
+                                    min_epochs=config.get('halving_min_epochs', 1), max_epochs=num_epochs,
+                                    eta=config.get('halving_eta', 3))
+        report_compute_saved(history, len(hyperparam_combinations), tscv.get_n_splits(), num_epochs)
     
     if results:
         best_result = min(results, key=lambda x: x['avg_val_loss'])
@@ -0,0 +1,138 @@
+# src/instrumentation.py
+import os
+import json
+import time
+from contextlib import contextmanager
+import torch
+
+# Per-epoch training metrics, one JSON object per line
+METRICS_PATH = 'logs/train_metrics.jsonl'
+PROFILE_DIR = 'logs/profiler'
+
+# Phases of a training epoch, in the order they happen
+PHASES = ('data', 'forward', 'backward', 'optimizer', 'validation', 'checkpoint')
+TRAIN_PHASES = ('data', 'forward', 'backward', 'optimizer')
+
+
+class EpochStats:
+    """
+    Wall time spent in each phase of a training epoch, and the samples trained.
+
+    Phases are timed with `phase(name)`, which also labels the span in a
+    torch.profiler trace; `batches(loader)` times every wait for the next
+    batch as 'data'. On CUDA the device is synchronized at the end of each
+    phase, so asynchronous kernels are charged to the phase that launched them.
+
+    Args:
+        device (torch.device): Training device.
+    """
+    def __init__(self, device=None):
+        self.sync = device is not None and torch.device(device).type == 'cuda'
+        self.reset()
+
+    def reset(self):
+        """Start a new epoch."""
+        self.times = dict.fromkeys(PHASES, 0.0)
+        self.samples = 0
+        self.start = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            with torch.profiler.record_function(name):
+                yield
+        finally:
+            if self.sync:
+                torch.cuda.synchronize()
+            self.times[name] += time.perf_counter() - start
+
+    def batches(self, loader):
+        """Iterate over loader, timing the wait for each batch as 'data'."""
+        iterator = iter(loader)
+        while True:
+            with self.phase('data'):
+                batch = next(iterator, None)
+            if batch is None:
+                return
+            yield batch
+
+    def summary(self, epoch, **extra):
+        """
+        The epoch's metrics as a JSON-serializable dict.
+
+        Returns:
+            dict: epoch, total seconds, samples, samples_per_sec (over the
+            training phases), seconds per phase, 'other' (time outside any
+            phase), plus the `extra` fields.
+        """
+        elapsed = time.perf_counter() - self.start
+        train_time = sum(self.times[name] for name in TRAIN_PHASES)
+        record = {
+            'epoch': epoch,
+            'seconds': round(elapsed, 6),
+            'samples': self.samples,
+            'samples_per_sec': round(self.samples / train_time, 3) if train_time > 0 else 0.0,
+        }
+        record.update({name: round(seconds, 6) for name, seconds in self.times.items()})
+        record['other'] = round(max(0.0, elapsed - sum(self.times.values())), 6)
+        record.update(extra)
+        return record
+
+
+def write_jsonl(path, record):
+    """Append one record to a JSON-lines file."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record) + '\n')
+
+
+class EpochProfiler:
+    """
+    torch.profiler over a window of epochs, exported as a Chrome trace
+    (open in chrome://tracing or Perfetto) when the window ends.
+
+    Args:
+        epochs (list): [first, last] epoch to profile, 1-based and inclusive
+            (a single number profiles one epoch).
+        trace_dir (str): Directory for the trace files.
+        trace_func (function): trace print function.
+    """
+    def __init__(self, epochs, trace_dir=PROFILE_DIR, trace_func=print):
+        if isinstance(epochs, int):
+            epochs = [epochs, epochs]
+        if len(epochs) != 2 or not 1 <= epochs[0] <= epochs[1]:
+            raise ValueError(f"profile_epochs must be an epoch or a [first, last] range, got {epochs!r}")
+        self.first, self.last = epochs
+        self.trace_dir = trace_dir
+        self.trace_func = trace_func
+        self.profiler = None
+        self.started = self.ended = None
+
+    def start(self, epoch):
+        """Called at the start of each (0-based) epoch."""
+        if self.profiler is None and self.first <= epoch + 1 <= self.last:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self.profiler = torch.profiler.profile(activities=activities)
+            self.profiler.__enter__()
+            self.started = epoch + 1
+
+    def stop(self, epoch):
+        """Called at the end of each (0-based) epoch; exports the trace after the window's last epoch."""
+        if self.profiler is not None:
+            self.ended = epoch + 1
+            if self.ended >= self.last:
+                self.close()
+
+    def close(self):
+        """Export the trace; also ends a window cut short (e.g. by early stopping)."""
+        if self.profiler is None:
+            return
+        self.profiler.__exit__(None, None, None)
+        os.makedirs(self.trace_dir, exist_ok=True)
+        path = os.path.join(self.trace_dir, f'epochs_{self.started}-{self.ended or self.started}.json')
+        self.profiler.export_chrome_trace(path)
+        self.profiler = None
+        self.trace_func(f"Profiler trace of epochs {self.started}-{self.ended or self.started} saved to {path}")
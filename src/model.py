@@ -1,6 +1,144 @@
+import os
+import sys
+import time
+import inspect
+import hashlib
+import contextlib
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.nn.utils.rnn import pack_padded_sequence
+
+COMPILE_MODES = ('eager', 'compile', 'script')
+# torch.compile's on-disk (Inductor) cache, so later runs reuse compiled kernels
+COMPILE_CACHE_DIR = 'models/compile_cache'
+
+def autocast(device, enabled=True):
+    """
+    bfloat16 autocast context for the forward pass (a no-op when disabled).
+    FinReportModel keeps BatchNorm and its output in float32, so losses
+    computed on the output stay in float32.
+    """
+    return torch.autocast(device_type=device.type, dtype=torch.bfloat16, enabled=enabled)
+
+def compile_model(model, mode='eager', example_input=None, training=False, script_path=None,
+                  weights_path=None, trace_func=print):
+    """
+    Module to run FinReportModel's forward passes through.
+
+    'compile' wraps the model with torch.compile (kernels are cached under
+    COMPILE_CACHE_DIR, so later runs start faster); 'script' traces it to
+    TorchScript, which fixes eval-mode behaviour and is therefore only used
+    for inference. With script_path, the traced module is saved there and
+    re-loaded on later runs while it is newer than weights_path and was
+    traced from the same model source and torch version. Parameters are
+    shared with `model` (except for a re-loaded script), so train and save
+    through `model` as before.
+
+    When example_input is given, the compiled module is run on it once so
+    the startup cost is paid and reported here: for training, as one
+    train-mode forward and backward pass whose BatchNorm statistics,
+    gradients and RNG draws are then restored; otherwise in eval mode,
+    without gradients. Any failure falls back to the eager model.
+
+    Args:
+        model (nn.Module): The eager model.
+        mode (str): One of COMPILE_MODES.
+        example_input (Tensor): A typical (batch, seq_len, features) input.
+        training (bool): The module will be used for training.
+    """
+    if mode not in COMPILE_MODES:
+        raise ValueError(f"compile mode must be one of {COMPILE_MODES}, got {mode!r}")
+    if mode == 'eager':
+        return model
+    if mode == 'script' and training:
+        trace_func("TorchScript tracing is inference-only; training runs eagerly")
+        return model
+
+    start = time.perf_counter()
+    was_training = model.training
+    try:
+        if mode == 'compile':
+            os.environ.setdefault('TORCHINDUCTOR_CACHE_DIR', os.path.abspath(COMPILE_CACHE_DIR))
+            compiled = torch.compile(model)
+        else:
+            compiled = _load_or_trace(model, example_input, script_path, weights_path, trace_func)
+        if example_input is not None:
+            _warm_up(model, compiled, example_input, training)
+    except Exception as e:
+        trace_func(f"Model {mode} failed ({type(e).__name__}: {e}); falling back to eager mode")
+        return model
+    finally:
+        model.train(was_training)
+    trace_func(f"Model prepared with {mode} in {time.perf_counter() - start:.2f}s")
+    return compiled
+
+def _warm_up(model, compiled, example_input, training):
+    if not training:
+        model.eval()
+        with torch.no_grad():
+            compiled(example_input)
+        return
+    # A real training step, so the graphs that training runs are the ones compiled,
+    # without leaving a trace in the model or in the random number streams
+    buffers = {name: buffer.clone() for name, buffer in model.named_buffers()}
+    # Backward accumulates into existing gradients in place: set them aside instead
+    grads = {name: param.grad for name, param in model.named_parameters()}
+    model.zero_grad(set_to_none=True)
+    devices = [example_input.device] if example_input.device.type == 'cuda' else []
+    # DistributedDataParallel would average the warm-up gradients across ranks
+    no_sync = model.no_sync() if hasattr(model, 'no_sync') else contextlib.nullcontext()
+    try:
+        with torch.random.fork_rng(devices=devices), no_sync:
+            model.train()
+            output = compiled(example_input)
+            if isinstance(output, tuple):
+                output = output[0]
+            output.float().sum().backward()
+    finally:
+        with torch.no_grad():
+            for name, buffer in model.named_buffers():
+                buffer.copy_(buffers[name])
+        for name, param in model.named_parameters():
+            param.grad = grads[name]
+
+def _script_key(model):
+    # The traced graph depends on the model code and the torch version, not only on the weights
+    source = inspect.getsource(sys.modules[type(model).__module__])
+    return hashlib.sha256(f"{source}\n{torch.__version__}".encode('utf-8')).hexdigest()
+
+def _load_or_trace(model, example_input, script_path, weights_path, trace_func):
+    key = _script_key(model)
+    if (script_path and os.path.exists(script_path) and weights_path and os.path.exists(weights_path)
+            and os.path.getmtime(script_path) >= os.path.getmtime(weights_path)):
+        extra_files = {'cache_key': ''}
+        scripted = torch.jit.load(script_path, _extra_files=extra_files)
+        if extra_files['cache_key'] == key.encode('utf-8'):
+            trace_func(f"Loading TorchScript model from {script_path}")
+            return scripted.eval()
+        trace_func(f"TorchScript model at {script_path} was traced from other code; tracing again")
+    if example_input is None:
+        raise ValueError("Tracing to TorchScript needs an example input")
+    model.eval()
+    traced = torch.jit.trace(model, example_input)
+    if script_path:
+        torch.jit.save(traced, script_path, _extra_files={'cache_key': key})
+        trace_func(f"TorchScript model saved to {script_path}")
+    return traced
+
+class SequenceModel(nn.Module):
+    """
+    FinReportModel run statefully: forward(x, state, mask) is its
+    forward_steps. Wrapping it as a module lets DistributedDataParallel and
+    torch.compile wrap the stateful pass like the windowed one. Parameters
+    are shared with `model`.
+    """
+    def __init__(self, model):
+        super(SequenceModel, self).__init__()
+        self.model = model
+
+    def forward(self, x, state=None, mask=None):
+        return self.model.forward_steps(x, state, mask)
 
 class FinReportModel(nn.Module):
     def __init__(self, input_size, hidden_size, num_layers=1, dropout=0.0):
@@ -43,16 +181,35 @@ class FinReportModel(nn.Module):
             elif 'bias' in name:
                 nn.init.constant_(param, 0.0)
 
-    def forward(self, x):
-        """Forward pass with regularization"""
-        # x shape: (batch_size, seq_len, input_size)
-        lstm_out, _ = self.lstm(x)  # (batch_size, seq_len, hidden_size)
+    def forward(self, x, lengths=None):
+        """
+        Forward pass with regularization
         
-        # Get the last time step output
-        last_hidden = lstm_out[:, -1, :]  # (batch_size, hidden_size)
+        Args:
+            x: (batch_size, seq_len, input_size) windows; with lengths, right-padded
+            lengths: Optional (batch_size,) number of valid steps of each window.
+                The batch is packed, so each prediction comes from its window's
+                last valid step and padding never reaches the LSTM.
+        """
+        if lengths is None:
+            # x shape: (batch_size, seq_len, input_size)
+            lstm_out, _ = self.lstm(x)  # (batch_size, seq_len, hidden_size)
+            
+            # Get the last time step output
+            last_hidden = lstm_out[:, -1, :]  # (batch_size, hidden_size)
+        else:
+            packed = pack_padded_sequence(x, lengths.cpu(), batch_first=True, enforce_sorted=False)
+            _, (h_n, _) = self.lstm(packed)
+            # Final hidden state of the top layer, back in batch order
+            last_hidden = h_n[-1]  # (batch_size, hidden_size)
         
-        # Apply batch normalization
-        normalized = self.batch_norm(last_hidden)
+        return self._head(last_hidden)  # (batch_size,), also for a batch of one
+
+    def _head(self, hidden):
+        """BatchNorm -> dropout -> linear over (N, hidden_size) LSTM outputs; returns (N,) float32."""
+        # Apply batch normalization; its statistics stay in float32 under bfloat16 autocast
+        with torch.autocast(device_type=hidden.device.type, enabled=False):
+            normalized = self.batch_norm(hidden.float())
         
         # Apply dropout for regularization
         dropped = self.dropout(normalized)
@@ -60,7 +217,29 @@ class FinReportModel(nn.Module):
         # Final linear layer
         out = self.fc(dropped)
         
-        return out.squeeze()  # (batch_size,)
+        return out.float().squeeze(-1)
+
+    def forward_steps(self, x, state=None, mask=None):
+        """
+        Stateful forward pass over one chunk of consecutive steps, with a
+        prediction for every step (truncated BPTT, see SequenceModel).
+        
+        Args:
+            x: (batch_size, steps, input_size) chunk of each lane's history
+            state: (h, c) LSTM state at the end of the previous chunk, or None to start fresh
+            mask: Optional (batch_size, steps) bool tensor of the steps to predict
+            
+        Returns:
+            tuple: (predictions, state) -- predictions are (batch_size, steps),
+            or the masked steps flattened to (N,); state is not detached.
+        """
+        lstm_out, state = self.lstm(x, state)  # (batch_size, steps, hidden_size)
+        # Only the masked steps go through BatchNorm, so padding never enters its statistics
+        hidden = lstm_out[mask] if mask is not None else lstm_out.reshape(-1, lstm_out.size(-1))
+        out = self._head(hidden)
+        if mask is None:
+            out = out.view(x.size(0), x.size(1))
+        return out, state
     
     def predict_with_uncertainty(self, x, mc_samples=10):
         """
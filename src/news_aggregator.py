@@ -11,7 +11,7 @@ def aggregate_news_factors(news_texts):
       - aggregated_event: dict with keys "value", "desc_base", "desc_highlight"
       - news_effect: dict representing overall news effect factor based on aggregated sentiment.
     """
-    if not news_texts:
+    if news_texts is None or len(news_texts) == 0:
         return None
 
     sentiment_scores = []
@@ -54,3 +54,10 @@ def aggregate_news_factors(news_texts):
         "aggregated_event": aggregated_event,
         "news_effect": news_effect
     }
+
+def aggregate_stock_news(news_table, ts_code, dates):
+    """
+    Aggregate the news factors of one stock over a set of dates, pulling the
+    texts from a data_store.NewsTable (see data_loader.load_news).
+    """
+    return aggregate_news_factors(news_table.texts(ts_code, dates))
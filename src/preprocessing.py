@@ -1,23 +1,45 @@
 # In preprocessing.py
 
+import json
+import os
+from functools import lru_cache
+import numpy as np
+import pandas as pd
 from sklearn.preprocessing import StandardScaler, LabelEncoder
 
-def rename_technical_columns(df):
+# Saved next to the model weights so evaluation uses the training feature layout
+FEATURE_SCHEMA_PATH = 'models/feature_schema.json'
+# Fitted normalization statistics, saved next to models/finreport_model.pth
+SCALER_STATS_PATH = 'models/scaler_stats.npz'
+EXCLUDE_COLS = ['date', 'announcement']
+LABEL_COL = 'label'
+
+@lru_cache(maxsize=32)
+def compile_rename_map(columns):
     """
-    Renames columns that look like tuple strings into a simpler format.
-    For example, convert "('technical_indicators_overbought_oversold', 'RSI')" to 
-    "technical_indicators_overbought_oversold_RSI".
+    Rename map for a tuple of column names: columns that look like tuple
+    strings map to a simpler name. Cached per column layout, so the string
+    parsing runs once instead of on every call.
     """
     new_columns = {}
-    for col in df.columns:
+    for col in columns:
         # Check if the column is a string that looks like a tuple.
         if isinstance(col, str) and col.startswith("(") and col.endswith(")"):
             # Remove parentheses and extra quotes, then replace comma with underscore.
-            new_col = col.strip("()").replace("'", "").replace(", ", "_")
-            new_columns[col] = new_col
-    df = df.rename(columns=new_columns)
-    # Debug: Print renamed columns
-    print("Renamed columns:", df.columns.tolist())
+            new_columns[col] = col.strip("()").replace("'", "").replace(", ", "_")
+    return new_columns
+
+def rename_technical_columns(df, verbose=False):
+    """
+    Renames columns that look like tuple strings into a simpler format.
+    For example, convert "('technical_indicators_overbought_oversold', 'RSI')" to 
+    "technical_indicators_overbought_oversold_RSI".
+    """
+    new_columns = compile_rename_map(tuple(df.columns))
+    if new_columns:
+        df = df.rename(columns=new_columns)
+    if verbose:
+        print("Renamed columns:", df.columns.tolist())
     return df
 
 def encode_ts_code(df):
@@ -27,27 +49,367 @@ def encode_ts_code(df):
     df['ts_code_encoded'] = le.fit_transform(df['ts_code'])
     return df, le
 
-def select_features(df):
-    # First, rename technical indicator columns.
-    df = rename_technical_columns(df)
-    
-    # Exclude columns such as 'date', 'announcement', and any other non-numeric ones.
-    exclude_cols = ['date', 'announcement']
-    feature_cols = [col for col in df.columns if col not in exclude_cols]
-    # Now only take numeric columns
-    numeric_cols = df[feature_cols].select_dtypes(include=['number']).columns.tolist()
-    features = df[numeric_cols].values
-    targets = df['label'].values  # assuming 'label' is numeric
+class FeatureSchema:
+    """
+    The model's input layout: ordered feature columns (after renaming), the
+    raw -> renamed column map and the feature dtypes.
+
+    Computed once from the training frame and saved next to the model, so
+    select_features becomes a column-position gather instead of re-deriving
+    the numeric columns for every frame, and a mismatch with
+    config.yaml's model.input_size is caught when the schema is loaded.
+    """
+    def __init__(self, feature_columns, rename_map, dtypes, label_column=LABEL_COL):
+        self.feature_columns = list(feature_columns)
+        self.rename_map = dict(rename_map)
+        self.dtypes = dict(dtypes)
+        self.label_column = label_column
+        self._indexed_columns = None
+        self._indexer = None
+        self._label_position = None
+
+    @classmethod
+    def from_frame(cls, df):
+        """Derive the schema: numeric columns other than 'date'/'announcement', in frame order."""
+        rename_map = compile_rename_map(tuple(df.columns))
+        feature_columns = []
+        dtypes = {}
+        for col, dtype in df.dtypes.items():
+            name = rename_map.get(col, col)
+            if name in EXCLUDE_COLS:
+                continue
+            if pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype):
+                feature_columns.append(name)
+                dtypes[name] = str(dtype)
+        return cls(feature_columns, rename_map, dtypes)
+
+    @property
+    def input_size(self):
+        return len(self.feature_columns)
+
+    def check_input_size(self, input_size):
+        if input_size != self.input_size:
+            raise ValueError(
+                f"Feature schema has {self.input_size} feature columns but config.yaml sets "
+                f"model.input_size to {input_size}; update the config or rebuild the schema."
+            )
+
+    def _index(self, df):
+        columns = tuple(df.columns)
+        if columns == self._indexed_columns:
+            return
+        positions = {name: i for i, name in enumerate(columns)}
+        # Frames that were not renamed are gathered by their raw column names.
+        for raw, renamed in self.rename_map.items():
+            if raw in positions and renamed not in positions:
+                positions[renamed] = positions[raw]
+        missing = [col for col in self.feature_columns + [self.label_column] if col not in positions]
+        if missing:
+            raise KeyError(f"Frame is missing feature columns: {missing}")
+        self._indexer = np.array([positions[col] for col in self.feature_columns])
+        self._label_position = positions[self.label_column]
+        self._indexed_columns = columns
+
+    def indexer(self, df):
+        """Positions of the feature columns in df (cached per column layout)."""
+        self._index(df)
+        return self._indexer
+
+    def label_position(self, df):
+        self._index(df)
+        return self._label_position
+
+    def to_dict(self):
+        return {
+            'feature_columns': self.feature_columns,
+            'rename_map': self.rename_map,
+            'dtypes': self.dtypes,
+            'label_column': self.label_column,
+        }
+
+    def save(self, path=FEATURE_SCHEMA_PATH):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    @classmethod
+    def load(cls, path=FEATURE_SCHEMA_PATH):
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(**json.load(f))
+
+def select_features(df, schema=None):
+    """
+    Gather the feature matrix and targets from a frame.
+
+    The features are written column by column into a single float32,
+    C-ordered matrix, so rows (and sequence windows) are contiguous and can
+    be handed to torch.from_numpy without another copy.
+
+    Args:
+        df (pd.DataFrame): Frame with raw or renamed technical columns.
+        schema (FeatureSchema): Precomputed layout; derived from df when omitted.
+    """
+    if schema is None:
+        schema = FeatureSchema.from_frame(df)
+    positions = schema.indexer(df)
+    features = np.empty((len(df), len(positions)), dtype=np.float32)
+    for j, pos in enumerate(positions):
+        features[:, j] = df.iloc[:, pos].to_numpy()
+    # assuming 'label' is numeric
+    targets = np.ascontiguousarray(df.iloc[:, schema.label_position(df)].to_numpy(), dtype=np.float32)
     
     # Ensure features and labels arrays are created from the same rows.
     assert len(features) == len(targets), "Features and labels must have the same length"
     
     return features, targets
 
-def normalize_features(features):
-    scaler = StandardScaler()
+def iter_features(chunks, schema=None):
+    """
+    Apply select_features to each (key, frame) chunk yielded by
+    data_loader.iter_data, so features can be built out-of-core with the
+    same renaming and column selection as the in-memory path. Without a
+    schema, the first chunk's layout is used for all chunks.
+
+    Yields:
+        tuple: (key, features, targets)
+    """
+    for key, frame in chunks:
+        if schema is None:
+            schema = FeatureSchema.from_frame(frame)
+        features, targets = select_features(frame, schema)
+        yield key, features, targets
+
+def normalize_features(features, copy=False):
+    """
+    Standardize features with a fitted StandardScaler. By default the
+    (float32) matrix is normalized in place rather than copied.
+    """
+    scaler = StandardScaler(copy=copy)
     return scaler.fit_transform(features), scaler
 
+def _safe_scale(var):
+    # Same convention as StandardScaler: constant columns are only centred
+    scale = np.sqrt(var)
+    scale[scale == 0.0] = 1.0
+    return scale
+
+class StreamingScaler:
+    """
+    StandardScaler that is fitted chunk by chunk, so the feature matrix
+    never has to be in memory at once. Each chunk is reduced to its count,
+    mean and sum of squared deviations in float64 and folded into the
+    running totals with Chan et al.'s pairwise update (the data itself stays
+    float32). Two scalers fitted on disjoint data, e.g. in different worker
+    processes, combine with merge() into the scaler of the union.
+    """
+    def __init__(self, n_features=None):
+        self.n_samples_seen_ = 0
+        self.mean_ = None if n_features is None else np.zeros(n_features)
+        self._m2 = None if n_features is None else np.zeros(n_features)
+
+    def _combine(self, count, mean, m2):
+        if count == 0:
+            return self
+        if self.mean_ is None or self.n_samples_seen_ == 0:
+            self.n_samples_seen_, self.mean_, self._m2 = count, mean, m2
+            return self
+        if len(mean) != len(self.mean_):
+            raise ValueError(f"Scaler was fitted on {len(self.mean_)} features, got {len(mean)}")
+        total = self.n_samples_seen_ + count
+        delta = mean - self.mean_
+        self.mean_ = self.mean_ + delta * (count / total)
+        self._m2 = self._m2 + m2 + delta * delta * (self.n_samples_seen_ * count / total)
+        self.n_samples_seen_ = total
+        return self
+
+    def partial_fit(self, features):
+        """Fold a (rows, features) chunk into the running statistics."""
+        features = np.asarray(features)
+        if not len(features):
+            return self
+        mean = features.mean(axis=0, dtype=np.float64)
+        deviations = features - mean
+        m2 = np.einsum('ij,ij->j', deviations, deviations)
+        return self._combine(len(features), mean, m2)
+
+    def merge(self, other):
+        """Add another scaler's statistics (fitted on disjoint rows) to this one."""
+        if other.mean_ is None:
+            return self
+        return self._combine(other.n_samples_seen_, other.mean_.copy(), other._m2.copy())
+
+    @property
+    def var_(self):
+        if not self.n_samples_seen_:
+            raise RuntimeError("StreamingScaler has not been fitted")
+        return self._m2 / self.n_samples_seen_
+
+    @property
+    def scale_(self):
+        return _safe_scale(self.var_)
+
+    def transform(self, features, copy=False):
+        if copy:
+            features = features.copy()
+        features -= self.mean_.astype(features.dtype)
+        features /= self.scale_.astype(features.dtype)
+        return features
+
+def fit_scaler_stats(chunks, per_stock=False):
+    """
+    Fit ScalerStats out-of-core from (key, features, targets) chunks, as
+    yielded by iter_features over data_loader.iter_data. With by='stock'
+    chunks each key is a ts_code and its statistics become that stock's row;
+    with by='date' chunks only the global row is fitted.
+
+    Args:
+        chunks: Iterable of (key, features, targets).
+        per_stock (bool): Keys are ts_codes; keep a row per stock.
+    """
+    total = StreamingScaler()
+    stock_scalers = {}
+    for key, features, _ in chunks:
+        if not len(features):
+            continue
+        chunk = StreamingScaler().partial_fit(features)
+        total.merge(chunk)
+        if per_stock:
+            stock_scalers.setdefault(str(key), StreamingScaler()).merge(chunk)
+    return ScalerStats.from_scalers(total, stock_scalers, per_stock=per_stock)
+
+class ScalerStats:
+    """
+    Table of fitted normalization statistics: a global mean/scale row plus
+    one row per ts_code. Saved as a small .npz next to the model weights,
+    so evaluation and live inference normalize new rows with a table lookup
+    instead of refitting a StandardScaler on every run.
+
+    With per_stock set, rows are normalized with their stock's statistics;
+    stocks without a row (not seen during fitting, or with no fitted rows)
+    fall back to the global row.
+    """
+    def __init__(self, mean, scale, stocks=(), stock_mean=None, stock_scale=None, per_stock=False):
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.scale = np.asarray(scale, dtype=np.float32)
+        n_features = len(self.mean)
+        self.stocks = np.asarray(stocks, dtype=str)
+        empty = np.empty((0, n_features), dtype=np.float32)
+        self.stock_mean = empty if stock_mean is None else np.asarray(stock_mean, dtype=np.float32)
+        self.stock_scale = empty if stock_scale is None else np.asarray(stock_scale, dtype=np.float32)
+        self.per_stock = bool(per_stock)
+        # The global row is appended last, so unknown stocks index it directly
+        self._mean_table = np.vstack([self.stock_mean, self.mean])
+        self._scale_table = np.vstack([self.stock_scale, self.scale])
+
+    @classmethod
+    def fit(cls, features, stock_ids=None, per_stock=False):
+        """
+        Fit global statistics and, when stock_ids are given, per-stock ones.
+        Accumulation is done in float64.
+
+        Args:
+            features (np.ndarray): (rows, features) matrix.
+            stock_ids (array-like): ts_code of each row.
+            per_stock (bool): Normalize with the per-stock rows in transform.
+        """
+        features = np.asarray(features)
+        mean = features.mean(axis=0, dtype=np.float64)
+        scale = _safe_scale(features.var(axis=0, dtype=np.float64))
+        if stock_ids is None:
+            return cls(mean, scale, per_stock=False)
+
+        stocks, inverse, counts = np.unique(np.asarray(stock_ids, dtype=str),
+                                            return_inverse=True, return_counts=True)
+        # Group rows by stock once and reduce each contiguous run
+        order = np.argsort(inverse, kind='stable')
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        grouped = features[order].astype(np.float64)
+        stock_mean = np.add.reduceat(grouped, starts, axis=0) / counts[:, None]
+        grouped -= np.repeat(stock_mean, counts, axis=0)
+        stock_var = np.add.reduceat(grouped * grouped, starts, axis=0) / counts[:, None]
+        return cls(mean, scale, stocks, stock_mean, _safe_scale(stock_var), per_stock=per_stock)
+
+    @classmethod
+    def from_scaler(cls, scaler):
+        """Global-only statistics from a fitted StandardScaler."""
+        return cls(scaler.mean_, scaler.scale_)
+
+    @classmethod
+    def from_scalers(cls, total, stock_scalers=None, per_stock=False):
+        """
+        Statistics from fitted StreamingScalers.
+
+        Args:
+            total (StreamingScaler): Fitted on the rows for the global row.
+            stock_scalers (dict): ts_code -> StreamingScaler; scalers that saw
+                no rows are left out, so those stocks use the global row.
+            per_stock (bool): Normalize with the per-stock rows in transform.
+        """
+        stock_scalers = {s: scaler for s, scaler in (stock_scalers or {}).items() if scaler.n_samples_seen_}
+        if not stock_scalers:
+            return cls(total.mean_, total.scale_)
+        stocks = sorted(stock_scalers)
+        return cls(total.mean_, total.scale_, stocks,
+                   np.stack([stock_scalers[s].mean_ for s in stocks]),
+                   np.stack([stock_scalers[s].scale_ for s in stocks]), per_stock=per_stock)
+
+    @property
+    def n_features(self):
+        return len(self.mean)
+
+    def rows(self, stock_ids):
+        """
+        Table row for each stock id (the global row for unknown stocks).
+        Categorical Series are looked up once per category.
+        """
+        if isinstance(stock_ids, pd.Series) and isinstance(stock_ids.dtype, pd.CategoricalDtype):
+            category_rows = self.rows(stock_ids.cat.categories)
+            codes = stock_ids.cat.codes.to_numpy()
+            # Missing values (code -1) take the global row
+            return np.where(codes >= 0, category_rows[codes], len(self.stocks))
+        ids = np.atleast_1d(np.asarray(stock_ids, dtype=str))
+        if not len(self.stocks):
+            return np.full(len(ids), 0, dtype=np.intp)
+        pos = np.searchsorted(self.stocks, ids).clip(max=len(self.stocks) - 1)
+        return np.where(self.stocks[pos] == ids, pos, len(self.stocks))
+
+    def transform(self, features, stock_ids=None, copy=False):
+        """
+        Normalize features (in place unless copy is set).
+
+        Args:
+            features (np.ndarray): (rows, features) float32 matrix.
+            stock_ids: A single ts_code for all rows, or one per row. Only
+                used when the statistics were fitted with per_stock.
+        """
+        if features.shape[-1] != self.n_features:
+            raise ValueError(f"Scaler statistics cover {self.n_features} features, got {features.shape[-1]}")
+        if copy:
+            features = features.copy()
+        if self.per_stock and stock_ids is not None:
+            rows = self.rows(stock_ids)
+            if len(rows) == 1 or (rows == rows[0]).all():
+                mean, scale = self._mean_table[rows[0]], self._scale_table[rows[0]]
+            else:
+                mean, scale = self._mean_table[rows], self._scale_table[rows]
+        else:
+            mean, scale = self.mean, self.scale
+        features -= mean
+        features /= scale
+        return features
+
+    def save(self, path=SCALER_STATS_PATH):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        np.savez(path, mean=self.mean, scale=self.scale, stocks=self.stocks,
+                 stock_mean=self.stock_mean, stock_scale=self.stock_scale,
+                 per_stock=np.array(self.per_stock))
+
+    @classmethod
+    def load(cls, path=SCALER_STATS_PATH):
+        with np.load(path) as data:
+            return cls(data['mean'], data['scale'], data['stocks'], data['stock_mean'],
+                       data['stock_scale'], per_stock=bool(data['per_stock']))
+
 if __name__ == "__main__":
     import pandas as pd
     test_df = pd.DataFrame({
@@ -56,6 +418,6 @@ if __name__ == "__main__":
         "announcement": ["Sample announcement"],
         "label": [1]
     })
-    test_df = rename_technical_columns(test_df)
+    test_df = rename_technical_columns(test_df, verbose=True)
     print("Test DataFrame after renaming:")
     print(test_df.head())
@@ -1,15 +1,26 @@
+import argparse
 import yaml
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torch.utils.data import DataLoader, Dataset, random_split
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import random_split
+from torch.utils.data.distributed import DistributedSampler
 import numpy as np
 import matplotlib.pyplot as plt
 import os
 import time
-from model import FinReportModel
-from data_loader import load_data, split_data
-from preprocessing import select_features, normalize_features
+from contextlib import nullcontext
+from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
+from model import FinReportModel, SequenceModel, autocast, compile_model
+from data_loader import data_filters
+from feature_store import open_feature_store
+from windows import WindowDataset, StockChunkLoader, make_window_loader, slice_offsets, stock_segments, LABEL_LAST
+from preprocessing import select_features, normalize_features, FEATURE_SCHEMA_PATH, SCALER_STATS_PATH
+from checkpoint import AsyncCheckpointer, load_checkpoint, rng_state, set_rng_state, CHECKPOINT_PATH
+from instrumentation import EpochStats, EpochProfiler, write_jsonl, METRICS_PATH, PROFILE_DIR
 
 # Create only necessary directories
 os.makedirs('models', exist_ok=True)
@@ -18,14 +29,15 @@ os.makedirs('img', exist_ok=True)
 # Early Stopping implementation
 class EarlyStopping:
     """Early stops the training if validation loss doesn't improve after a given patience."""
-    def __init__(self, patience=7, verbose=False, delta=0, path='checkpoint.pt', trace_func=print):
+    def __init__(self, patience=7, verbose=False, delta=0, path='checkpoint.pt', trace_func=print, checkpointer=None):
         """
         Args:
             patience (int): How long to wait after last time validation loss improved.
             verbose (bool): If True, prints a message for each validation loss improvement.
             delta (float): Minimum change in the monitored quantity to qualify as an improvement.
-            path (str): Path for the checkpoint to be saved to.
+            path (str): Path for the checkpoint to be saved to (None: don't save).
             trace_func (function): trace print function.
+            checkpointer (AsyncCheckpointer): Writes the checkpoint in the background (None: torch.save inline).
         """
         self.patience = patience
         self.verbose = verbose
@@ -36,7 +48,8 @@ class EarlyStopping:
         self.delta = delta
         self.path = path
         self.trace_func = trace_func
-        
+        self.checkpointer = checkpointer
+
     def __call__(self, val_loss, model):
         score = -val_loss
 
@@ -57,9 +70,22 @@ class EarlyStopping:
         '''Saves model when validation loss decrease.'''
         if self.verbose:
             self.trace_func(f'Validation loss decreased ({self.val_loss_min:.6f} --> {val_loss:.6f}). Saving model ...')
-        torch.save(model.state_dict(), self.path)
+        if self.path is not None and self.checkpointer is not None:
+            self.checkpointer.save(model.state_dict(), self.path)
+        elif self.path is not None:
+            torch.save(model.state_dict(), self.path)
         self.val_loss_min = val_loss
 
+    def state_dict(self):
+        return {'counter': self.counter, 'best_score': self.best_score,
+                'early_stop': self.early_stop, 'val_loss_min': self.val_loss_min}
+
+    def load_state_dict(self, state):
+        self.counter = state['counter']
+        self.best_score = state['best_score']
+        self.early_stop = state['early_stop']
+        self.val_loss_min = state['val_loss_min']
+
 def plot_learning_curves(train_losses, val_losses):
     """Plot the training and validation loss curves."""
     plt.figure(figsize=(10, 6))
@@ -73,281 +99,556 @@ def plot_learning_curves(train_losses, val_losses):
     plt.close()
     print("Learning curves saved to 'img/learning_curves.png'")
 
-# Load configuration from config.yaml
-with open('src/config.yaml', 'r') as file:
-    config = yaml.safe_load(file)
-
-# Extract hyperparameters from the config
-data_path = config['data_path']
-batch_size = config['batch_size']
-seq_len = config['seq_len']
-learning_rate = config['learning_rate']
-num_epochs = config['num_epochs']
-model_config = config['model']
-input_size = model_config['input_size']       # Make sure this matches your feature count
-hidden_size = model_config['hidden_size']
-num_layers = model_config.get('num_layers', 1)  # default to 1 if not provided
-dropout = model_config.get('dropout', 0.0)      # default to 0.0 if not provided
-
-# Add validation parameters
-val_ratio = 0.2  # 20% of data for validation
-patience = 7     # Early stopping patience
-
-print("Loaded configuration:")
-print(config)
-
-# Set device
-device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-print(f"Using device: {device}")
-
-# Load and preprocess data
-print("Loading data...")
-df = load_data(data_path)
-train_df, test_df = split_data(df)
-train_features, train_labels = select_features(train_df)
-test_features, test_labels = select_features(test_df)
-
-# Normalize features
-train_features, scaler = normalize_features(train_features)
-test_features = scaler.transform(test_features)
-
-# Define the dataset class (for sequence data)
-class FinDataset(Dataset):
-    def __init__(self, features, labels, seq_len):
-        # Ensure features and labels are of the same length
-        min_len = min(len(features), len(labels))
-        self.features = features[:min_len]
-        self.labels = labels[:min_len]
-        self.seq_len = seq_len
-
-    def __len__(self):
-        # Only return valid indices where we can construct a full sequence
-        return max(0, len(self.features) - self.seq_len)
-
-    def __getitem__(self, idx):
-        # Get a sequence of length seq_len starting at idx
-        x = self.features[idx:idx + self.seq_len]
-        
-        # Get the label that follows the sequence
-        y = self.labels[idx + self.seq_len - 1]  # Use the last element of the sequence window
-        
-        return torch.tensor(x, dtype=torch.float), torch.tensor(y, dtype=torch.float)
-
-# Create full dataset
-full_dataset = FinDataset(train_features, train_labels, seq_len)
-
-# Split into train and validation
-dataset_size = len(full_dataset)
-val_size = int(val_ratio * dataset_size)
-train_size = dataset_size - val_size
-
-# Create train and validation datasets
-train_dataset, val_dataset = random_split(full_dataset, [train_size, val_size])
-print(f"Train dataset size: {len(train_dataset)}")
-print(f"Validation dataset size: {len(val_dataset)}")
-
-# Create data loaders
-train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True)
-val_loader = DataLoader(val_dataset, batch_size=batch_size, shuffle=False)
-
-test_dataset = FinDataset(test_features, test_labels, seq_len)
-test_loader = DataLoader(test_dataset, batch_size=batch_size, shuffle=False)
-
-# Initialize the model with parameters from the config
-model = FinReportModel(input_size=input_size, hidden_size=hidden_size, num_layers=num_layers)
-model = model.to(device)
-
-# Count trainable parameters
-trainable_params = sum(p.numel() for p in model.parameters() if p.requires_grad)
-print(f"Model has {trainable_params:,} trainable parameters")
-
-# Initialize optimizer (without weight decay since dropout=0.0 was optimal)
-optimizer = optim.Adam(model.parameters(), lr=learning_rate)
-
-# Initialize loss function
-criterion = nn.MSELoss()
-
-# Initialize learning rate scheduler
-scheduler = optim.lr_scheduler.ReduceLROnPlateau(
-    optimizer, mode='min', factor=0.5, patience=3, min_lr=0.00001, verbose=True
-)
-
-# Initialize early stopping
-early_stopping = EarlyStopping(
-    patience=patience,
-    verbose=True,
-    delta=0.0001,
-    path='models/best_model.pt'
-)
-
-# Training loop with validation
-train_losses = []
-val_losses = []
-learning_rates = []
-
-start_time = time.time()
-print("Starting training...")
+def load_config(path='src/config.yaml'):
+    with open(path, 'r') as file:
+        return yaml.safe_load(file)
+
+def global_mean(total, count):
+    """Mean of per-rank (sum, count) pairs over all ranks; plain division in a single process."""
+    if dist.is_available() and dist.is_initialized():
+        buffer = torch.tensor([total, count], dtype=torch.float64)
+        dist.all_reduce(buffer)
+        total, count = buffer.tolist()
+    return total / count
+
+def global_reduce(value, op='sum'):
+    """Sum (or 'max') of a per-rank number over all ranks; the number itself in a single process."""
+    if dist.is_available() and dist.is_initialized():
+        buffer = torch.tensor([value], dtype=torch.float64)
+        dist.all_reduce(buffer, op=dist.ReduceOp.MAX if op == 'max' else dist.ReduceOp.SUM)
+        value = type(value)(buffer.item())
+    return value
+
+def gather_rng_state():
+    """RNG states of every rank (a list indexed by rank) when distributed; of this process otherwise."""
+    state = rng_state()
+    if dist.is_available() and dist.is_initialized():
+        states = [None] * dist.get_world_size()
+        dist.all_gather_object(states, state)
+        state = states
+    return state
+
+def broadcast_flag(flag):
+    """Rank 0's value of a boolean decision, so all ranks act on it together."""
+    if dist.is_available() and dist.is_initialized():
+        buffer = torch.tensor([int(flag)])
+        dist.broadcast(buffer, src=0)
+        flag = bool(buffer.item())
+    return flag
+
+def stateful_pass(module, loader, criterion, device, optimizer=None, params=None, mixed_precision=False,
+                  stats=None, outputs=None):
+    """
+    One truncated-BPTT pass over a StockChunkLoader: the LSTM state is
+    carried from chunk to chunk of the same histories and detached in
+    between, so gradients flow back through at most one chunk.
+
+    When training distributed, every rank must run the same number of
+    chunks (see StockChunkLoader.pad_to): the optimizer steps when any rank
+    scored a step in the chunk, so all ranks take the same steps and their
+    optimizer states stay equal.
+
+    Args:
+        module: SequenceModel (or a DDP / compiled wrapper of one).
+        optimizer: Trains on every chunk when given; otherwise only evaluates.
+        params: Parameters to clip gradients of.
+        stats (EpochStats): Times the training phases.
+        outputs (tuple): (predictions, targets) lists to extend with the scored steps.
+
+    Returns:
+        tuple: (sum of the per-step losses, number of scored steps)
+    """
+    training = optimizer is not None
+    phase = stats.phase if stats is not None else (lambda name: nullcontext())
+    batches = stats.batches(loader) if stats is not None else loader
+    loss_sum, count, state = 0.0, 0, None
+    for x, y, mask, reset in batches:
+        with phase('data'):
+            x, y, mask = x.to(device), y.to(device), mask.to(device)
+        # Truncate backpropagation at the chunk boundary; new histories start from a zero state
+        state = None if reset else tuple(s.detach() for s in state)
+        n = int(mask.sum())
+        if training and n == 1:
+            # BatchNorm needs two values to train on; the step is carried through unscored
+            mask, n = torch.zeros_like(mask), 0
+        with phase('forward'):
+            with autocast(device, mixed_precision):
+                preds, state = module(x, state, mask)
+            # A chunk with nothing to score still runs backward, so DDP ranks stay in step
+            loss = criterion(preds, y[mask]) if n else preds.sum() * 0.0
+        if training:
+            with phase('backward'):
+                optimizer.zero_grad()
+                loss.backward()
+            # The gradients are averaged over the ranks, so step whenever any rank scored
+            if global_reduce(n):
+                with phase('optimizer'):
+                    torch.nn.utils.clip_grad_norm_(params, max_norm=1.0)
+                    optimizer.step()
+        if not n:
+            continue
+        loss_sum += loss.item() * n
+        count += n
+        if outputs is not None:
+            outputs[0].extend(preds.detach().cpu().numpy())
+            outputs[1].extend(y[mask].cpu().numpy())
+    return loss_sum, count
+
+def train(config, rank=0, world_size=1, resume=None):
+    """
+    Train, test and save the model. With world_size > 1 this runs in each of
+    the DDP worker processes (see train_worker), and rank 0 does the logging,
+    checkpointing, testing and plotting.
+
+    After every epoch the full training state (model, optimizer, scheduler,
+    early stopping, loss history and RNG states) is written to
+    checkpoint_path; `resume` names such a checkpoint to continue from.
+
+    With `stateful`, the model is trained with truncated BPTT over whole
+    stock histories (see stateful_pass) instead of on independent windows.
+    """
+    distributed = world_size > 1
+    is_main = rank == 0
+    log = print if is_main else (lambda *args, **kwargs: None)
+
+    # Extract hyperparameters from the config
+    data_path = config['data_path']
+    batch_size = config['batch_size']
+    seq_len = config['seq_len']
+    learning_rate = config['learning_rate']
+    num_epochs = config['num_epochs']
+    model_config = config['model']
+    input_size = model_config['input_size']       # Make sure this matches your feature count
+    hidden_size = model_config['hidden_size']
+    num_layers = model_config.get('num_layers', 1)  # default to 1 if not provided
+    dropout = model_config.get('dropout', 0.0)      # default to 0.0 if not provided
+    per_stock_scaling = config.get('per_stock_scaling', False)
+    batched_loader = config.get('batched_loader', True)
+    resident_windows_mb = config.get('resident_windows_mb', 0)
+    mixed_precision = config.get('mixed_precision', False)  # bfloat16 autocast for forward passes
+    compile_mode = config.get('compile', 'eager')
+    checkpoint_path = config.get('checkpoint_path', CHECKPOINT_PATH)
+    async_checkpoints = config.get('async_checkpoints', True)
+    metrics_path = config.get('metrics_path', METRICS_PATH)  # per-epoch timing breakdown (None disables)
+    profile_epochs = config.get('profile_epochs')             # e.g. [2, 3]: torch.profiler trace of epochs 2-3
+    stateful = config.get('stateful', False)  # truncated BPTT over whole stock histories
+    bptt_len = config.get('bptt_len', 50)     # steps per chunk in stateful mode
+
+    # Add validation parameters
+    val_ratio = 0.2  # 20% of data for validation
+    patience = 7     # Early stopping patience
+
+    log("Loaded configuration:")
+    log(config)
+
+    # Set device (distributed training runs on CPU over gloo)
+    device = torch.device('cuda' if torch.cuda.is_available() and not distributed else 'cpu')
+    log(f"Using device: {device}" + (f" | rank {rank} of {world_size}, {torch.get_num_threads()} threads" if distributed else ""))
+
+    # Load and preprocess data
+    log("Loading data...")
+    # The feature store holds the selected features, normalized with statistics
+    # fitted on the training rows. It is memory-mapped, and only rebuilt when the
+    # data, the filters or the scaling mode change.
+    store = open_feature_store(data_path, data_filters(config), per_stock=per_stock_scaling)
+    log(f"Feature store: {len(store)} rows from {len(store.stocks)} stocks ({store.root})")
+
+    # Check the feature layout against the config and save it, with the scaler
+    # statistics, next to the model
+    schema = store.schema
+    schema.check_input_size(input_size)
+    if is_main:
+        schema.save(FEATURE_SCHEMA_PATH)
+        log(f"Feature schema ({schema.input_size} columns) saved to {FEATURE_SCHEMA_PATH}")
+        store.stats.save(SCALER_STATS_PATH)
+        log(f"Scaler statistics ({len(store.stats.stocks)} stocks) saved to {SCALER_STATS_PATH}")
+
+    # Same split as split_data: the leading rows train, the rest test
+    split = store.train_rows()
+    train_features, train_labels = store.features[:split], store.labels[:split]
+    test_features, test_labels = store.features[split:], store.labels[split:]
+    # Stock boundaries within each split, so no window mixes two stocks
+    train_offsets = slice_offsets(store.offsets, 0, split)
+    test_offsets = slice_offsets(store.offsets, split, len(store))
+
+    # Every rank must draw the same train/validation split, and a resumed run
+    # the split it started with, so the seed goes into the checkpoint.
+    checkpoint = load_checkpoint(resume) if resume else None
+    if checkpoint is not None:
+        split_seed = checkpoint['split_seed']
+    elif distributed:
+        split_seed = config.get('seed', 0)
+    else:
+        split_seed = int(torch.randint(2 ** 62, ()))
+
+    train_sampler = None
+    if stateful:
+        # Each stock's training rows in time order, in chunks of bptt_len steps and
+        # batch_size stocks at a time; the last val_ratio of every stock validates.
+        # The first seq_len - 1 steps of a history are not scored, as no window ends there.
+        train_segments, val_segments = stock_segments(train_offsets, holdout=val_ratio)
+        chunk_options = dict(chunk_len=bptt_len, batch_size=batch_size, warmup=seq_len - 1,
+                             rank=rank, num_replicas=world_size)
+        train_loader = StockChunkLoader(train_features, train_labels, train_segments, shuffle=True, **chunk_options)
+        val_loader = StockChunkLoader(train_features, train_labels, val_segments, **chunk_options)
+        test_loader = StockChunkLoader(test_features, test_labels, stock_segments(test_offsets),
+                                       bptt_len, batch_size, warmup=seq_len - 1)
+        if distributed:
+            # Ranks hold different numbers of chunks; the ones with fewer pad so all run in lockstep
+            train_loader.pad_to(global_reduce(train_loader.num_chunks(), op='max'))
+        log(f"Stateful training: {len(train_segments)} stock histories, chunks of {bptt_len} steps")
+        log(f"Train steps: {train_loader.num_samples()}")
+        log(f"Validation steps: {val_loader.num_samples()}")
+    else:
+        # Create full dataset: every single-stock window of the training rows, labelled with its last row
+        full_dataset = WindowDataset(train_features, train_labels, seq_len, label=LABEL_LAST, offsets=train_offsets)
+
+        # Split into train and validation
+        dataset_size = len(full_dataset)
+        val_size = int(val_ratio * dataset_size)
+        train_size = dataset_size - val_size
+
+        # Create train and validation datasets
+        split_generator = torch.Generator().manual_seed(split_seed)
+        train_dataset, val_dataset = random_split(full_dataset, [train_size, val_size], generator=split_generator)
+        log(f"Train dataset size: {len(train_dataset)}")
+        log(f"Validation dataset size: {len(val_dataset)}")
 
-for epoch in range(num_epochs):
-    epoch_start_time = time.time()
-    
-    # Training phase
-    model.train()
-    train_loss = 0.0
+        # Create data loaders
+        # Whole minibatches are gathered at once; the windows stay resident when they fit the budget.
+        # In distributed mode each rank trains and validates on its own shard of the windows.
+        val_sampler = None
+        if distributed:
+            train_sampler = DistributedSampler(train_dataset, num_replicas=world_size, rank=rank,
+                                               shuffle=True, seed=config.get('seed', 0))
+            val_sampler = DistributedSampler(val_dataset, num_replicas=world_size, rank=rank, shuffle=False)
+        train_loader = make_window_loader(train_dataset, batch_size, shuffle=True, sampler=train_sampler,
+                                          batched=batched_loader, resident_mb=resident_windows_mb)
+        val_loader = make_window_loader(val_dataset, batch_size, shuffle=False, sampler=val_sampler,
+                                        batched=batched_loader, resident_mb=resident_windows_mb)
+
+        test_dataset = WindowDataset(test_features, test_labels, seq_len, label=LABEL_LAST, offsets=test_offsets)
+        test_loader = make_window_loader(test_dataset, batch_size, shuffle=False, batched=batched_loader)
+
+    # Initialize the model with parameters from the config
+    model = FinReportModel(input_size=input_size, hidden_size=hidden_size, num_layers=num_layers)
+    model = model.to(device)
+
+    # Count trainable parameters
+    trainable_params = sum(p.numel() for p in model.parameters() if p.requires_grad)
+    log(f"Model has {trainable_params:,} trainable parameters")
+
+    # Forward passes go through the (optionally compiled) module; it shares the
+    # parameters of `model`, which is still what gets optimized and saved.
+    # DistributedDataParallel averages the gradients across ranks.
+    # In stateful mode the module is the SequenceModel view of the same model.
+    base_module = SequenceModel(model) if stateful else model
+    train_module = DistributedDataParallel(base_module) if distributed else base_module
+    example_len = bptt_len if stateful else seq_len
+    forward_model = compile_model(train_module, compile_mode, training=True, trace_func=log,
+                                  example_input=torch.zeros(batch_size, example_len, input_size, device=device))
+
+    # Initialize optimizer (without weight decay since dropout=0.0 was optimal)
+    optimizer = optim.Adam(model.parameters(), lr=learning_rate)
+
+    # Initialize loss function
+    criterion = nn.MSELoss()
+
+    # Initialize learning rate scheduler
+    scheduler = optim.lr_scheduler.ReduceLROnPlateau(
+        optimizer, mode='min', factor=0.5, patience=3, min_lr=0.00001, verbose=True
+    )
+
+    # Checkpoints are snapshotted in memory and written by a background thread,
+    # so the training loop never waits on the disk
+    checkpointer = AsyncCheckpointer(enabled=async_checkpoints) if is_main else None
+
+    # Initialize early stopping
+    # (every rank tracks it on the same reduced losses; only rank 0 writes the checkpoint)
+    early_stopping = EarlyStopping(
+        patience=patience,
+        verbose=True,
+        delta=0.0001,
+        path='models/best_model.pt' if is_main else None,
+        trace_func=log,
+        checkpointer=checkpointer
+    )
+
+    # Training loop with validation
+    train_losses = []
+    val_losses = []
+    learning_rates = []
+    start_epoch = 0
+
+    if checkpoint is not None:
+        model.load_state_dict(checkpoint['model'])
+        optimizer.load_state_dict(checkpoint['optimizer'])
+        scheduler.load_state_dict(checkpoint['scheduler'])
+        early_stopping.load_state_dict(checkpoint['early_stopping'])
+        train_losses = checkpoint['train_losses']
+        val_losses = checkpoint['val_losses']
+        learning_rates = checkpoint['learning_rates']
+        start_epoch = checkpoint['epoch'] + 1
+        # Shuffling and dropout continue with the random streams of the interrupted run;
+        # each rank has its own (a resume with more ranks than the checkpointed run reuses rank 0's)
+        rng = checkpoint['rng']
+        if isinstance(rng, list):
+            rng = rng[rank] if rank < len(rng) else rng[0]
+        set_rng_state(rng)
+        log(f"Resuming from {resume} after epoch {start_epoch}")
+        if early_stopping.early_stop:
+            log("The checkpointed run had already stopped early")
+            start_epoch = num_epochs
+
+    # Time spent per phase of each epoch (waiting for data, forward, backward,
+    # optimizer step, validation, checkpointing); rank 0 writes it as JSON lines
+    stats = EpochStats(device)
+    profiler = EpochProfiler(profile_epochs, config.get('profile_dir', PROFILE_DIR), trace_func=log) \
+        if profile_epochs and is_main else None
+
+    start_time = time.time()
+    log("Starting training...")
+
+    for epoch in range(start_epoch, num_epochs):
+        epoch_start_time = time.time()
+        stats.reset()
+        if profiler is not None:
+            profiler.start(epoch)
     
-    for x_batch, y_batch in train_loader:
-        x_batch, y_batch = x_batch.to(device), y_batch.to(device)
-        
-        optimizer.zero_grad()
-        outputs = model(x_batch)
-        loss = criterion(outputs, y_batch)
-        loss.backward()
+        # Training phase
+        model.train()
+        train_loss = 0.0
+        train_count = 0
+        if train_sampler is not None:
+            train_sampler.set_epoch(epoch)
+
+        if stateful:
+            train_loss, train_count = stateful_pass(forward_model, train_loader, criterion, device,
+                                                    optimizer, list(model.parameters()), mixed_precision, stats)
+        else:
+            for x_batch, y_batch in stats.batches(train_loader):
+                with stats.phase('data'):
+                    x_batch, y_batch = x_batch.to(device), y_batch.to(device)
         
-        # Apply gradient clipping to prevent exploding gradients
-        torch.nn.utils.clip_grad_norm_(model.parameters(), max_norm=1.0)
+                with stats.phase('forward'):
+                    optimizer.zero_grad()
+                    with autocast(device, mixed_precision):
+                        outputs = forward_model(x_batch)
+                    loss = criterion(outputs, y_batch)  # outputs are float32, so is the loss
+                with stats.phase('backward'):
+                    loss.backward()
         
-        optimizer.step()
+                with stats.phase('optimizer'):
+                    # Apply gradient clipping to prevent exploding gradients
+                    torch.nn.utils.clip_grad_norm_(model.parameters(), max_norm=1.0)
+                    optimizer.step()
         
-        train_loss += loss.item() * x_batch.size(0)
+                train_loss += loss.item() * x_batch.size(0)
+                train_count += x_batch.size(0)
+        stats.samples = train_count
     
-    train_loss /= len(train_loader.dataset)
-    train_losses.append(train_loss)
+        train_loss = global_mean(train_loss, train_count)
+        train_losses.append(train_loss)
     
-    # Validation phase
-    model.eval()
-    val_loss = 0.0
+        # Validation phase
+        model.eval()
+        val_loss = 0.0
+        val_count = 0
     
-    with torch.no_grad():
-        for x_val, y_val in val_loader:
-            x_val, y_val = x_val.to(device), y_val.to(device)
+        with torch.no_grad(), stats.phase('validation'):
+            if stateful:
+                # No gradients to sync: each rank scores its own histories without the DDP wrapper
+                eval_module = base_module if distributed else forward_model
+                val_loss, val_count = stateful_pass(eval_module, val_loader, criterion, device,
+                                                    mixed_precision=mixed_precision)
+            else:
+                for x_val, y_val in val_loader:
+                    x_val, y_val = x_val.to(device), y_val.to(device)
             
-            outputs = model(x_val)
-            loss = criterion(outputs, y_val)
+                    with autocast(device, mixed_precision):
+                        outputs = forward_model(x_val)
+                    loss = criterion(outputs, y_val)
             
-            val_loss += loss.item() * x_val.size(0)
-    
-    val_loss /= len(val_loader.dataset)
-    val_losses.append(val_loss)
+                    val_loss += loss.item() * x_val.size(0)
+                    val_count += x_val.size(0)
     
-    # Update learning rate
-    scheduler.step(val_loss)
+        # Averaged over all ranks, so the scheduler and early stopping see the same value everywhere
+        val_loss = global_mean(val_loss, val_count)
+        val_losses.append(val_loss)
     
-    # Store current learning rate
-    current_lr = optimizer.param_groups[0]['lr']
-    learning_rates.append(current_lr)
+        # Update learning rate
+        scheduler.step(val_loss)
     
-    # Early stopping check
-    early_stopping(val_loss, model)
+        # Store current learning rate
+        current_lr = optimizer.param_groups[0]['lr']
+        learning_rates.append(current_lr)
     
-    # Print epoch statistics
-    epoch_time = time.time() - epoch_start_time
-    print(f"Epoch {epoch+1}/{num_epochs} | "
-          f"Time: {epoch_time:.2f}s | "
-          f"Train Loss: {train_loss:.6f} | "
-          f"Val Loss: {val_loss:.6f} | "
-          f"LR: {current_lr:.6f}")
+        with stats.phase('checkpoint'):
+            # Early stopping check (saves the best model)
+            early_stopping(val_loss, model)
+
+            # Every rank's random streams go into rank 0's checkpoint
+            rng = gather_rng_state()
+
+            # Everything needed to continue after this epoch (see --resume)
+            if checkpointer is not None:
+                checkpointer.save({
+                    'epoch': epoch,
+                    'split_seed': split_seed,
+                    'model': model.state_dict(),
+                    'optimizer': optimizer.state_dict(),
+                    'scheduler': scheduler.state_dict(),
+                    'early_stopping': early_stopping.state_dict(),
+                    'train_losses': train_losses,
+                    'val_losses': val_losses,
+                    'learning_rates': learning_rates,
+                    'rng': rng,
+                }, checkpoint_path)
     
-    if early_stopping.early_stop:
-        print(f"Early stopping triggered at epoch {epoch+1}")
-        break
-
-# Calculate total training time
-total_time = time.time() - start_time
-print(f"Training completed in {total_time:.2f} seconds")
-
-# Load best model
-model.load_state_dict(torch.load('models/best_model.pt'))
-
-# Evaluate on test set
-model.eval()
-test_loss = 0.0
-all_test_preds = []
-all_test_targets = []
-
-with torch.no_grad():
-    for x_test, y_test in test_loader:
-        x_test, y_test = x_test.to(device), y_test.to(device)
-        
-        outputs = model(x_test)
-        loss = criterion(outputs, y_test)
-        
-        test_loss += loss.item() * x_test.size(0)
-        all_test_preds.extend(outputs.cpu().numpy())
-        all_test_targets.extend(y_test.cpu().numpy())
+        # Print epoch statistics
+        epoch_time = time.time() - epoch_start_time
+        metrics = stats.summary(epoch + 1, train_loss=train_loss, val_loss=val_loss, lr=current_lr,
+                                rank=rank, world_size=world_size)
+        log(f"Epoch {epoch+1}/{num_epochs} | "
+              f"Time: {epoch_time:.2f}s | "
+              f"Train Loss: {train_loss:.6f} | "
+              f"Val Loss: {val_loss:.6f} | "
+              f"LR: {current_lr:.6f} | "
+              f"{metrics['samples_per_sec']:,.0f} samples/s, data wait {metrics['data']:.2f}s")
+        if metrics_path and is_main:
+            write_jsonl(metrics_path, metrics)
+        if profiler is not None:
+            profiler.stop(epoch)
+
+        if broadcast_flag(early_stopping.early_stop):
+            log(f"Early stopping triggered at epoch {epoch+1}")
+            break
+
+    # Calculate total training time
+    total_time = time.time() - start_time
+    log(f"Training completed in {total_time:.2f} seconds")
+    if profiler is not None:
+        profiler.close()
+    if metrics_path and is_main:
+        log(f"Per-epoch timings written to {metrics_path}")
+
+    # Flush the pending checkpoint writes before the best model is read back
+    if checkpointer is not None:
+        checkpointer.close()
+        log(f"Training state checkpointed to {checkpoint_path}")
+
+    # Rank 0 alone tests, saves and plots
+    if distributed:
+        dist.barrier()
+        if not is_main:
+            return
+        forward_model = base_module
+
+    # Load best model
+    model.load_state_dict(torch.load('models/best_model.pt'))
+
+    # Evaluate on test set
+    model.eval()
+    test_loss = 0.0
+    all_test_preds = []
+    all_test_targets = []
 
-test_loss /= len(test_loader.dataset)
-print(f"Test Loss: {test_loss:.6f}")
+    with torch.no_grad():
+        if stateful:
+            # Each stock's test rows run on from a fresh state, scored after seq_len - 1 steps like windows
+            test_loss, test_count = stateful_pass(forward_model, test_loader, criterion, device,
+                                                  mixed_precision=mixed_precision,
+                                                  outputs=(all_test_preds, all_test_targets))
+        else:
+            test_count = len(test_loader.dataset)
+            for x_test, y_test in test_loader:
+                x_test, y_test = x_test.to(device), y_test.to(device)
+            
+                with autocast(device, mixed_precision):
+                    outputs = forward_model(x_test)
+                loss = criterion(outputs, y_test)
+            
+                test_loss += loss.item() * x_test.size(0)
+                all_test_preds.extend(outputs.cpu().numpy())
+                all_test_targets.extend(y_test.cpu().numpy())
 
-# Calculate regression metrics
-all_test_preds = np.array(all_test_preds)
-all_test_targets = np.array(all_test_targets)
+    test_loss /= test_count
+    log(f"Test Loss: {test_loss:.6f}")
 
-from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
-test_mse = mean_squared_error(all_test_targets, all_test_preds)
-test_rmse = np.sqrt(test_mse)
-test_mae = mean_absolute_error(all_test_targets, all_test_preds)
-test_r2 = r2_score(all_test_targets, all_test_preds)
-
-print(f"Test MSE: {test_mse:.6f}")
-print(f"Test RMSE: {test_rmse:.6f}")
-print(f"Test MAE: {test_mae:.6f}")
-print(f"Test R²: {test_r2:.6f}")
-
-# Save model
-torch.save(model.state_dict(), 'models/finreport_model.pth')
-print("Model saved to models/finreport_model.pth")
-
-# Plot learning curves
-plt.figure(figsize=(12, 8))
-
-# Loss plot
-plt.subplot(2, 2, 1)
-plt.plot(train_losses, label='Train Loss')
-plt.plot(val_losses, label='Validation Loss')
-plt.xlabel('Epoch')
-plt.ylabel('Loss')
-plt.title('Training and Validation Loss')
-plt.legend()
-plt.grid(True)
-
-# Learning rate plot
-plt.subplot(2, 2, 2)
-plt.plot(learning_rates)
-plt.xlabel('Epoch')
-plt.ylabel('Learning Rate')
-plt.title('Learning Rate Schedule')
-plt.grid(True)
-
-# Predictions vs Actual plot
-plt.subplot(2, 2, 3)
-plt.scatter(all_test_targets, all_test_preds, alpha=0.3)
-min_val = min(np.min(all_test_targets), np.min(all_test_preds))
-max_val = max(np.max(all_test_targets), np.max(all_test_preds))
-plt.plot([min_val, max_val], [min_val, max_val], 'r--')
-plt.xlabel('Actual Values')
-plt.ylabel('Predicted Values')
-plt.title(f'Predictions vs Actual (R² = {test_r2:.4f})')
-plt.grid(True)
-
-# Error distribution plot
-plt.subplot(2, 2, 4)
-errors = all_test_preds - all_test_targets
-plt.hist(errors, bins=30)
-plt.axvline(x=0, color='r', linestyle='--')
-plt.xlabel('Prediction Error')
-plt.ylabel('Frequency')
-plt.title(f'Error Distribution (RMSE = {test_rmse:.4f})')
-plt.grid(True)
-
-plt.tight_layout()
-plt.savefig('img/training_results.png')
-plt.close()
-
-print("Training results plots saved to img/training_results.png")
-print("Training script completed successfully")
-
-def perform_cross_validation(df, model_config, k_folds=5):
+    # Calculate regression metrics
+    all_test_preds = np.array(all_test_preds)
+    all_test_targets = np.array(all_test_targets)
+
+    test_mse = mean_squared_error(all_test_targets, all_test_preds)
+    test_rmse = np.sqrt(test_mse)
+    test_mae = mean_absolute_error(all_test_targets, all_test_preds)
+    test_r2 = r2_score(all_test_targets, all_test_preds)
+
+    log(f"Test MSE: {test_mse:.6f}")
+    log(f"Test RMSE: {test_rmse:.6f}")
+    log(f"Test MAE: {test_mae:.6f}")
+    log(f"Test R²: {test_r2:.6f}")
+
+    # Save model
+    torch.save(model.state_dict(), 'models/finreport_model.pth')
+    log("Model saved to models/finreport_model.pth")
+
+    # Plot learning curves
+    plt.figure(figsize=(12, 8))
+
+    # Loss plot
+    plt.subplot(2, 2, 1)
+    plt.plot(train_losses, label='Train Loss')
+    plt.plot(val_losses, label='Validation Loss')
+    plt.xlabel('Epoch')
+    plt.ylabel('Loss')
+    plt.title('Training and Validation Loss')
+    plt.legend()
+    plt.grid(True)
+
+    # Learning rate plot
+    plt.subplot(2, 2, 2)
+    plt.plot(learning_rates)
+    plt.xlabel('Epoch')
+    plt.ylabel('Learning Rate')
+    plt.title('Learning Rate Schedule')
+    plt.grid(True)
+
+    # Predictions vs Actual plot
+    plt.subplot(2, 2, 3)
+    plt.scatter(all_test_targets, all_test_preds, alpha=0.3)
+    min_val = min(np.min(all_test_targets), np.min(all_test_preds))
+    max_val = max(np.max(all_test_targets), np.max(all_test_preds))
+    plt.plot([min_val, max_val], [min_val, max_val], 'r--')
+    plt.xlabel('Actual Values')
+    plt.ylabel('Predicted Values')
+    plt.title(f'Predictions vs Actual (R² = {test_r2:.4f})')
+    plt.grid(True)
+
+    # Error distribution plot
+    plt.subplot(2, 2, 4)
+    errors = all_test_preds - all_test_targets
+    plt.hist(errors, bins=30)
+    plt.axvline(x=0, color='r', linestyle='--')
+    plt.xlabel('Prediction Error')
+    plt.ylabel('Frequency')
+    plt.title(f'Error Distribution (RMSE = {test_rmse:.4f})')
+    plt.grid(True)
+
+    plt.tight_layout()
+    plt.savefig('img/training_results.png')
+    plt.close()
+
+    log("Training results plots saved to img/training_results.png")
+    log("Training script completed successfully")
+
+def perform_cross_validation(df, model_config, k_folds=5, config=None, device=None):
     from sklearn.model_selection import TimeSeriesSplit
+    config = config or load_config()
+    device = device or torch.device('cpu')
+    batched_loader = config.get('batched_loader', True)
+    resident_windows_mb = config.get('resident_windows_mb', 0)
+    mixed_precision = config.get('mixed_precision', False)
     # Extract parameters
     input_size = model_config['input_size']
     hidden_size = model_config['hidden_size']
@@ -379,16 +680,17 @@ def perform_cross_validation(df, model_config, k_folds=5):
         train_labels, test_labels = labels[train_idx], labels[test_idx]
         
         # Create datasets
-        train_dataset = FinDataset(train_features, train_labels, seq_len)
-        test_dataset = FinDataset(test_features, test_labels, seq_len)
+        train_dataset = WindowDataset(train_features, train_labels, seq_len, label=LABEL_LAST)
+        test_dataset = WindowDataset(test_features, test_labels, seq_len, label=LABEL_LAST)
         
         if len(train_dataset) == 0 or len(test_dataset) == 0:
             print(f"Skipping fold {fold+1} due to insufficient data")
             continue
         
         # Create data loaders
-        train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True)
-        test_loader = DataLoader(test_dataset, batch_size=batch_size, shuffle=False)
+        train_loader = make_window_loader(train_dataset, batch_size, shuffle=True, batched=batched_loader,
+                                          resident_mb=resident_windows_mb)
+        test_loader = make_window_loader(test_dataset, batch_size, shuffle=False, batched=batched_loader)
         
         # Initialize model
         model = FinReportModel(input_size=input_size, hidden_size=hidden_size, 
@@ -405,7 +707,8 @@ def perform_cross_validation(df, model_config, k_folds=5):
             for x_batch, y_batch in train_loader:
                 x_batch, y_batch = x_batch.to(device), y_batch.to(device)
                 optimizer.zero_grad()
-                outputs = model(x_batch)
+                with autocast(device, mixed_precision):
+                    outputs = model(x_batch)
                 loss = criterion(outputs, y_batch)
                 loss.backward()
                 optimizer.step()
@@ -418,7 +721,8 @@ def perform_cross_validation(df, model_config, k_folds=5):
         with torch.no_grad():
             for x_test, y_test in test_loader:
                 x_test, y_test = x_test.to(device), y_test.to(device)
-                outputs = model(x_test)
+                with autocast(device, mixed_precision):
+                    outputs = model(x_test)
                 all_preds.extend(outputs.cpu().numpy())
                 all_labels.extend(y_test.cpu().numpy())
         
@@ -471,4 +775,41 @@ def perform_cross_validation(df, model_config, k_folds=5):
         print(f"Average MAE: {avg_mae:.6f}")
         print(f"Average R²: {avg_r2:.6f}")
     
-    return fold_metrics
\ No newline at end of file
+    return fold_metrics
+
+def train_worker(rank, world_size, config, resume=None):
+    """Entry point of one DDP worker process (torch.multiprocessing.spawn)."""
+    os.environ.setdefault('MASTER_ADDR', '127.0.0.1')
+    os.environ.setdefault('MASTER_PORT', str(config.get('master_port', 29500)))
+    # Share the cores between the workers instead of oversubscribing them
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // world_size))
+    dist.init_process_group('gloo', rank=rank, world_size=world_size)
+    try:
+        train(config, rank, world_size, resume=resume)
+    finally:
+        dist.destroy_process_group()
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the FinReport model.")
+    parser.add_argument('--config', default='src/config.yaml')
+    parser.add_argument('--world-size', type=int, default=None,
+                        help="Local DDP worker processes (default: world_size from the config, or 1)")
+    parser.add_argument('--resume', nargs='?', const='', default=None, metavar='CHECKPOINT',
+                        help="Continue from a training checkpoint (default: checkpoint_path from the config)")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    world_size = args.world_size or config.get('world_size', 1)
+    resume = args.resume
+    if resume == '':
+        resume = config.get('checkpoint_path', CHECKPOINT_PATH)
+    if world_size > 1:
+        # Build the feature store once, before the workers memory-map it
+        open_feature_store(config['data_path'], data_filters(config),
+                           per_stock=config.get('per_stock_scaling', False))
+        mp.spawn(train_worker, args=(world_size, config, resume), nprocs=world_size, join=True)
+    else:
+        train(config, resume=resume)
+
+if __name__ == "__main__":
+    main()
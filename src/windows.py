@@ -0,0 +1,426 @@
+# src/windows.py
+import numpy as np
+import torch
+from numpy.lib.stride_tricks import sliding_window_view
+from torch.utils.data import Dataset, DataLoader, Subset
+
+# Label alignment of a window starting at row idx:
+LABEL_LAST = 'last'  # labels[idx + seq_len - 1], the window's last row (train.py, evalute.py)
+LABEL_NEXT = 'next'  # labels[idx + seq_len], the row after the window (hyperparameter.py)
+LABEL_OFFSETS = {LABEL_LAST: -1, LABEL_NEXT: 0}
+
+
+def slice_offsets(offsets, start, stop):
+    """
+    Stock boundaries of rows [start, stop) of a stock-grouped matrix,
+    relative to start (e.g. for a train/test split that cuts a stock).
+
+    Args:
+        offsets (np.ndarray): Row offsets of each stock plus the total, as in FeatureStore.offsets.
+    """
+    inner = np.asarray(offsets)
+    inner = inner[(inner > start) & (inner < stop)]
+    return np.concatenate(([0], inner - start, [stop - start])).astype(np.int64)
+
+
+def valid_window_starts(offsets, label_offset):
+    """
+    Start rows of the windows that lie within a single stock, label row
+    included, built without a per-stock loop.
+
+    Args:
+        offsets (np.ndarray): Stock start rows plus the total row count.
+        label_offset (int): Label row relative to the window start.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    counts = np.maximum(np.diff(offsets) - label_offset, 0)
+    total = counts.sum()
+    # Each stock's starts are offsets[i] + 0..counts[i]-1: a global arange shifted per stock
+    shift = np.repeat(offsets[:-1] - (np.cumsum(counts) - counts), counts)
+    return np.arange(total, dtype=np.int64) + shift
+
+
+class WindowDataset(Dataset):
+    """
+    All length-seq_len windows over a (rows, features) matrix.
+
+    The windows are a strided view of the base matrix (sliding_window_view),
+    so nothing is copied up front and a single window is handed to torch
+    without a copy. A minibatch is one fancy-index gather over the view
+    (gather / __getitems__), instead of seq_len-row slices and a collate per
+    sample; use window_loader to get a DataLoader that takes this path.
+
+    Args:
+        features (np.ndarray): (rows, features) float32, C-ordered matrix.
+        labels (np.ndarray): One label per row.
+        seq_len (int): Window length.
+        label (str): LABEL_LAST or LABEL_NEXT, which row's label a window gets.
+        offsets (np.ndarray): Stock boundaries (start rows plus the total) of
+            a matrix that holds several stocks. Only windows inside one stock
+            are then served, via a precomputed index of valid start rows.
+    """
+    def __init__(self, features, labels, seq_len, label=LABEL_LAST, offsets=None):
+        if label not in LABEL_OFFSETS:
+            raise ValueError(f"label must be one of {sorted(LABEL_OFFSETS)}, got {label!r}")
+        if len(features) != len(labels):
+            raise ValueError(f"Got {len(features)} feature rows but {len(labels)} labels")
+        self.features = features
+        self.labels = labels
+        self.seq_len = seq_len
+        self.label = label
+        self.label_offset = seq_len + LABEL_OFFSETS[label]
+        # Windows whose label row exists: the last window start is rows - label_offset - 1
+        self.starts = None
+        self.num_windows = max(0, len(features) - self.label_offset)
+        if offsets is not None:
+            self.starts = valid_window_starts(offsets, self.label_offset)
+            self.num_windows = len(self.starts)
+        if self.num_windows:
+            # (windows, features, seq_len) -> (windows, seq_len, features), still a view
+            self.windows = sliding_window_view(features, seq_len, axis=0).swapaxes(1, 2)
+        else:
+            self.windows = np.empty((0, seq_len, features.shape[1]), dtype=features.dtype)
+
+    def __len__(self):
+        return self.num_windows
+
+    def label_index(self, starts):
+        """Label row of the windows starting at `starts`."""
+        return np.asarray(starts) + self.label_offset
+
+    def window_starts(self, indices):
+        """Start rows of the windows with the given dataset indices."""
+        if self.starts is None:
+            return np.asarray(indices, dtype=np.intp)
+        return self.starts[indices]
+
+    def __getitem__(self, idx):
+        if not 0 <= idx < self.num_windows:
+            raise IndexError(idx)
+        if self.starts is not None:
+            idx = int(self.starts[idx])
+        # A plain row slice of the base matrix (the view itself is read-only)
+        x = self.features[idx:idx + self.seq_len]
+        y = self.labels[idx + self.label_offset]
+        return torch.as_tensor(x, dtype=torch.float), torch.tensor(y, dtype=torch.float)
+
+    def gather(self, indices):
+        """
+        Windows and labels for a whole minibatch.
+
+        Returns:
+            tuple: (x, y) tensors of shape (batch, seq_len, features) and (batch,).
+        """
+        indices = self.window_starts(np.asarray(indices, dtype=np.intp))
+        x = self.windows[indices]  # one gather into a fresh contiguous array
+        y = self.labels[indices + self.label_offset]
+        return (torch.from_numpy(np.ascontiguousarray(x, dtype=np.float32)),
+                torch.from_numpy(np.ascontiguousarray(y, dtype=np.float32)))
+
+    # DataLoader (and Subset) call this with a batch's indices when it exists
+    __getitems__ = gather
+
+
+class VariableWindowDataset(Dataset):
+    """
+    Windows of up to seq_len rows ending at each target row, cut short where
+    the history (the stock) starts, so rows with less history than seq_len
+    are scored as well. Labels follow LABEL_LAST: a window gets the label of
+    its last row.
+
+    gather() returns right-padded batches with each window's length, for
+    FinReportModel.forward(x, lengths); batch them with BucketedWindowLoader
+    so windows of similar length share a batch.
+
+    Args:
+        features (np.ndarray): (rows, features) float32 matrix.
+        labels (np.ndarray): One label per row.
+        seq_len (int): Maximum window length.
+        targets (np.ndarray): Rows to predict (default: every row).
+        min_len (int): Leave out targets with fewer rows of history than this.
+        offsets (np.ndarray): Stock boundaries of a multi-stock matrix; windows never cross them.
+    """
+    def __init__(self, features, labels, seq_len, targets=None, min_len=1, offsets=None):
+        if len(features) != len(labels):
+            raise ValueError(f"Got {len(features)} feature rows but {len(labels)} labels")
+        targets = np.arange(len(features), dtype=np.int64) if targets is None else np.asarray(targets, np.int64)
+        offsets = np.array([0, len(features)], dtype=np.int64) if offsets is None else np.asarray(offsets, np.int64)
+        # Start row of the stock each target belongs to
+        history_start = offsets[np.searchsorted(offsets, targets, side='right') - 1]
+        starts = np.maximum(history_start, targets - seq_len + 1)
+        keep = targets - starts + 1 >= max(min_len, 1)
+        self.features = features
+        self.labels = labels
+        self.seq_len = seq_len
+        self.targets = targets[keep]
+        self.starts = starts[keep]
+        self.lengths = self.targets - self.starts + 1
+
+    def __len__(self):
+        return len(self.targets)
+
+    def gather(self, indices):
+        """
+        Returns:
+            tuple: (x, y, lengths) -- x (batch, longest, features) padded
+            after each window's end, y (batch,), lengths (batch,) int64.
+        """
+        indices = np.asarray(indices, dtype=np.intp)
+        starts, targets, lengths = self.starts[indices], self.targets[indices], self.lengths[indices]
+        # Rows past a window's end repeat its last row; packing skips them
+        rows = np.minimum(starts[:, None] + np.arange(lengths.max()), targets[:, None])
+        return (torch.from_numpy(np.ascontiguousarray(self.features[rows], dtype=np.float32)),
+                torch.from_numpy(np.ascontiguousarray(self.labels[targets], dtype=np.float32)),
+                torch.from_numpy(lengths))
+
+    __getitems__ = gather
+
+
+class BucketedWindowLoader:
+    """
+    Batches of a VariableWindowDataset grouped by window length: windows are
+    ordered by length and cut into batches, so each batch pads to a length
+    close to all of its windows'. Shuffling reorders the batches.
+
+    Yields (x, y, lengths); `order` holds the dataset indices in the order
+    they are yielded, to put predictions back in row order.
+    """
+    def __init__(self, dataset, batch_size, shuffle=False, generator=None):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.generator = generator
+        self.order = np.argsort(-dataset.lengths, kind='stable')
+        self.batches = [self.order[i:i + batch_size] for i in range(0, len(self.order), batch_size)]
+
+    def padding_ratio(self):
+        """Padded steps as a fraction of all steps in the batches."""
+        lengths = self.dataset.lengths
+        padded = sum(lengths[batch].max() * len(batch) for batch in self.batches)
+        return 1 - lengths.sum() / padded if padded else 0.0
+
+    def __len__(self):
+        return len(self.batches)
+
+    def __iter__(self):
+        if self.shuffle:
+            batch_order = torch.randperm(len(self.batches), generator=self.generator).tolist()
+            self.order = np.concatenate([self.batches[b] for b in batch_order]) if self.batches else self.order
+        else:
+            batch_order = range(len(self.batches))
+        for b in batch_order:
+            yield self.dataset.gather(self.batches[b])
+
+
+def collate_windows(batch):
+    """collate_fn for WindowDataset: __getitems__ already returns stacked tensors."""
+    return batch
+
+
+def window_loader(dataset, batch_size, shuffle=False, **kwargs):
+    """DataLoader that fetches each minibatch of a WindowDataset (or a Subset of one) in one gather."""
+    return DataLoader(dataset, batch_size=batch_size, shuffle=shuffle, collate_fn=collate_windows, **kwargs)
+
+
+class WindowBatchLoader:
+    """
+    Minibatches of a WindowDataset without DataLoader's per-batch machinery.
+
+    Each batch is one fancy-index gather over the window view, and shuffling
+    is a permutation of window indices (torch.randperm, so torch.manual_seed
+    applies as with DataLoader). With a memory budget (resident_mb) that the
+    full window tensor fits into, the windows are materialized once as a
+    contiguous tensor and batches index it directly; sequential batches are
+    then plain slices.
+
+    Iterates like a DataLoader over (x, y) batches and keeps `.dataset`, so
+    it can stand in for window_loader in the training loops. A sampler (e.g.
+    a DistributedSampler) replaces the built-in order: each epoch's batches
+    are cut from the positions it yields.
+
+    Args:
+        dataset: WindowDataset, or a Subset of one (as from random_split).
+        batch_size (int): Windows per batch.
+        shuffle (bool): Reshuffle the windows every epoch.
+        drop_last (bool): Skip a final incomplete batch.
+        resident_mb (float): Keep all windows in memory when they fit in this many MB (0 = never).
+        generator (torch.Generator): Source of the shuffling permutations.
+        sampler: Iterable of dataset positions, used instead of shuffle.
+    """
+    def __init__(self, dataset, batch_size, shuffle=False, drop_last=False, resident_mb=0, generator=None,
+                 sampler=None):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.generator = generator
+        self.sampler = sampler
+        if isinstance(dataset, Subset):
+            self.windows = dataset.dataset
+            self.indices = np.asarray(dataset.indices, dtype=np.intp)
+        else:
+            self.windows = dataset
+            self.indices = None
+        self.resident = None
+        if resident_mb and self.nbytes() <= resident_mb * 1024 ** 2:
+            self.resident = self.windows.gather(self._window_indices(np.arange(len(dataset))))
+
+    def nbytes(self):
+        """Size of the full (windows, seq_len, features) float32 tensor."""
+        n_features = self.windows.features.shape[1]
+        return len(self.dataset) * self.windows.seq_len * n_features * 4
+
+    def _window_indices(self, positions):
+        return positions if self.indices is None else self.indices[positions]
+
+    def set_epoch(self, epoch):
+        """Forwarded to the sampler, so a DistributedSampler reshuffles per epoch."""
+        if hasattr(self.sampler, 'set_epoch'):
+            self.sampler.set_epoch(epoch)
+
+    def __len__(self):
+        n = len(self.dataset) if self.sampler is None else len(self.sampler)
+        if self.drop_last:
+            return n // self.batch_size
+        return -(-n // self.batch_size)
+
+    def __iter__(self):
+        if self.sampler is not None:
+            order = np.fromiter(iter(self.sampler), dtype=np.intp)
+        elif self.shuffle:
+            order = torch.randperm(len(self.dataset), generator=self.generator).numpy()
+        else:
+            order = None
+        n = len(self.dataset) if order is None else len(order)
+        stop = n - n % self.batch_size if self.drop_last else n
+        for start in range(0, stop, self.batch_size):
+            end = min(start + self.batch_size, n)
+            if self.resident is not None:
+                x, y = self.resident
+                if order is None:
+                    yield x[start:end], y[start:end]
+                else:
+                    batch = torch.from_numpy(order[start:end])
+                    yield x[batch], y[batch]
+            else:
+                positions = np.arange(start, end) if order is None else order[start:end]
+                yield self.windows.gather(self._window_indices(positions))
+
+
+def make_window_loader(dataset, batch_size, shuffle=False, batched=True, resident_mb=0, sampler=None, **kwargs):
+    """
+    Loader for a WindowDataset: a WindowBatchLoader when batched, otherwise a
+    DataLoader (window_loader) that also accepts DataLoader options such as
+    num_workers. A sampler takes the place of shuffle in both.
+    """
+    if batched:
+        return WindowBatchLoader(dataset, batch_size, shuffle=shuffle, resident_mb=resident_mb, sampler=sampler)
+    if sampler is not None:
+        return window_loader(dataset, batch_size, sampler=sampler, **kwargs)
+    return window_loader(dataset, batch_size, shuffle=shuffle, **kwargs)
+
+
+def stock_segments(offsets, holdout=0.0):
+    """
+    (start, stop) rows of each stock's history, optionally split in time:
+    the last `holdout` fraction of every stock becomes a second segment.
+
+    Returns:
+        np.ndarray, or a (head, tail) pair of them when holdout > 0: (stocks, 2) row ranges.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    starts, stops = offsets[:-1], offsets[1:]
+    if not holdout:
+        return np.stack([starts, stops], axis=1)
+    cut = stops - ((stops - starts) * holdout).astype(np.int64)
+    return np.stack([starts, cut], axis=1), np.stack([cut, stops], axis=1)
+
+
+class StockChunkLoader:
+    """
+    Whole stock histories in consecutive chunks, for stateful (truncated
+    BPTT) training that carries the LSTM state from one chunk to the next.
+
+    Segments are grouped batch_size at a time, longest first so that a
+    group's histories have similar lengths, and each group is one (batch,
+    rows, features) block cut into chunk_len steps. Lanes of shorter
+    segments are padded past their end; the mask leaves out the padding and
+    each segment's first `warmup` steps (predictions made with less context
+    than a window would have). Every row is fed through the LSTM once per
+    epoch, instead of once per window that contains it.
+
+    Yields (x, y, mask, reset): x (batch, steps, features) and y, mask
+    (batch, steps) tensors, and reset=True for the first chunk of a group,
+    where the state must start fresh. After pad_to(n), an epoch is at least
+    n chunks long: the extra chunks are single steps with nothing to score.
+
+    Args:
+        features (np.ndarray): (rows, features) float32 matrix.
+        labels (np.ndarray): One label per row (the label of the step that ends at that row).
+        segments (np.ndarray): (n, 2) start/stop rows of each history, as from stock_segments.
+        chunk_len (int): Steps per chunk (the truncated-BPTT length).
+        batch_size (int): Histories per group.
+        shuffle (bool): Visit the groups in a new random order every epoch.
+        generator (torch.Generator): Source of the group order.
+        warmup (int): Leading steps of each segment that are not scored.
+        rank (int), num_replicas (int): This process's share of the groups in distributed training.
+    """
+    def __init__(self, features, labels, segments, chunk_len, batch_size, shuffle=False, warmup=0, generator=None,
+                 rank=0, num_replicas=1):
+        segments = np.asarray(segments, dtype=np.int64).reshape(-1, 2)
+        segments = segments[segments[:, 1] - segments[:, 0] > warmup]
+        lengths = segments[:, 1] - segments[:, 0]
+        order = np.argsort(-lengths, kind='stable')
+        groups = [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+        self.features = features
+        self.labels = labels
+        self.segments = segments
+        self.chunk_len = chunk_len
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.warmup = warmup
+        self.generator = generator
+        self.groups = groups[rank::num_replicas]
+        self.min_chunks = 0
+
+    def num_samples(self):
+        """Scored steps per epoch."""
+        lengths = self.segments[:, 1] - self.segments[:, 0]
+        return int(sum(lengths[group].sum() - self.warmup * len(group) for group in self.groups))
+
+    def __len__(self):
+        return max(self.num_chunks(), self.min_chunks)
+
+    def num_chunks(self):
+        """Chunks of this loader's own histories, before padding."""
+        lengths = self.segments[:, 1] - self.segments[:, 0]
+        return int(sum(-(-lengths[group].max() // self.chunk_len) for group in self.groups))
+
+    def pad_to(self, num_chunks):
+        """
+        Yield at least num_chunks chunks per epoch, so that every rank in
+        distributed training runs the same number of steps in lockstep.
+        """
+        self.min_chunks = num_chunks
+
+    def __iter__(self):
+        if self.shuffle:
+            group_order = torch.randperm(len(self.groups), generator=self.generator).tolist()
+        else:
+            group_order = range(len(self.groups))
+        for g in group_order:
+            starts, stops = self.segments[self.groups[g]].T
+            lengths = stops - starts
+            steps = np.arange(lengths.max())
+            # Row of every (lane, step); lanes past their end repeat their last row
+            rows = starts[:, None] + np.minimum(steps, lengths[:, None] - 1)
+            valid = (steps >= self.warmup) & (steps < lengths[:, None])
+            for t in range(0, len(steps), self.chunk_len):
+                chunk = rows[:, t:t + self.chunk_len]
+                yield (torch.from_numpy(np.ascontiguousarray(self.features[chunk], dtype=np.float32)),
+                       torch.from_numpy(np.ascontiguousarray(self.labels[chunk], dtype=np.float32)),
+                       torch.from_numpy(valid[:, t:t + self.chunk_len]),
+                       t == 0)
+        for _ in range(self.num_chunks(), self.min_chunks):
+            yield (torch.zeros(1, 1, self.features.shape[1]), torch.zeros(1, 1),
+                   torch.zeros(1, 1, dtype=torch.bool), True)